@@ -0,0 +1 @@
+from .backends import available_backends, load_extension
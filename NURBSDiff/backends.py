@@ -0,0 +1,52 @@
+import importlib
+import importlib.util
+import threading
+
+
+# Compiled extensions built by setup.py, grouped by the backend they provide
+EXTENSIONS = {
+    'cpp': ('curve_eval_cpp', 'surf_eval_cpp'),
+    'cuda': ('curve_eval_cuda', 'surf_eval_cuda'),
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_extension(name):
+    """
+    Imports the compiled extension NURBSDiff.<name> on first use and returns
+    it, or None when it was not built or fails to load. Results are memoised,
+    so the import cost is paid at most once per process.
+    """
+    with _lock:
+        if name not in _loaded:
+            try:
+                _loaded[name] = importlib.import_module('NURBSDiff.' + name)
+            except ImportError:
+                _loaded[name] = None
+        return _loaded[name]
+
+
+def has_extension(name):
+    # Checks whether the extension is installed without importing it
+    if name in _loaded:
+        return _loaded[name] is not None
+    return importlib.util.find_spec('NURBSDiff.' + name) is not None
+
+
+def available_backends():
+    """
+    Returns the evaluation backends usable in this process. 'torch' (plain
+    tensor operations) is always available; 'cpp' and 'cuda' are listed when
+    their extensions are installed, and 'cuda' additionally needs a device.
+    No extension is imported.
+    """
+    import torch
+    backends = ['torch']
+    for backend, names in EXTENSIONS.items():
+        if backend == 'cuda' and not torch.cuda.is_available():
+            continue
+        if all(has_extension(name) for name in names):
+            backends.append(backend)
+    return tuple(backends)
@@ -0,0 +1,87 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class BasisCache(object):
+    """
+    Bounded LRU cache for precomputed spans, basis functions and basis
+    matrices, shared by all evaluation modules of the process.
+
+    Entries are keyed on the knot vectors, parameter grids, degrees and
+    control point counts, together with the dtype and device of every tensor
+    involved. Cached tensors are shared between modules and must be treated
+    as read-only.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        key = []
+        for part in parts:
+            if torch.is_tensor(part):
+                # Raw bytes, so that dtypes numpy lacks (bfloat16) hash as well
+                data = part.detach().contiguous().cpu().reshape(-1).view(torch.uint8).numpy().tobytes()
+                key.append((tuple(part.shape), str(part.dtype), str(part.device), hashlib.sha1(data).hexdigest()))
+            else:
+                key.append(part)
+        return tuple(key)
+
+    def lookup(self, key, compute):
+        # key: tuple returned by make_key, compute: callable producing the value on a miss
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+basis_cache = BasisCache()
+
+
+def cached(compute, *parts):
+    # Returns compute() through the process-wide cache, keyed on parts
+    return basis_cache.lookup(BasisCache.make_key(*parts), compute)
+
+
+def cache_info():
+    return basis_cache.info()
+
+
+def clear_cache():
+    basis_cache.clear()
+
+
+def set_cache_size(maxsize):
+    basis_cache.resize(maxsize)
@@ -0,0 +1,297 @@
+import torch
+
+
+# GridIndex.query hands unresolved queries over to the tiled search once the
+# scanned cube holds more than 1/FALLBACK_RATIO cells per target, or after
+# MAX_RINGS shells: past that, one cell costs about as much as FALLBACK_RATIO
+# distances in the tiled search, and each shell adds loop overhead
+FALLBACK_RATIO = 32
+MAX_RINGS = 64
+
+class GridIndex(object):
+    """
+    Uniform voxel grid over a static batch of target clouds (B, M, d), for
+    exact nearest neighbour queries without forming the N x M distance
+    matrix. Targets are bucketed by cell once; a query scans cubic shells
+    of cells around its own cell until no unscanned cell can hold a closer
+    target. Works on any device. The index holds a detached copy of the
+    targets and must be rebuilt when they change.
+    """
+    def __init__(self, target, points_per_cell=4):
+        target = target.detach()
+        B, M, d = target.shape
+        self.target = target.reshape(B*M, d)
+        self.B, self.M, self.d = B, M, d
+        self.lo = target.reshape(-1, d).amin(dim=0)
+        extent = (target.reshape(-1, d).amax(dim=0) - self.lo).tolist()
+
+        # Cell size giving about points_per_cell targets per occupied cell;
+        # axes thinner than one cell (flat or straight clouds) are left out
+        cells = max(M/points_per_cell, 1.0)
+        active = [e for e in extent if e > 0]
+        h = 1.0
+        for _ in range(3):
+            if not active:
+                break
+            vol = 1.0
+            for e in active:
+                vol *= e
+            h = (vol/cells)**(1.0/len(active))
+            active = [e for e in extent if e > h]
+        self.h = h
+        self.res = torch.tensor([int(e/h) + 1 for e in extent], device=target.device)
+        self.strides = torch.cumprod(torch.cat((self.res.new_ones(1), self.res[:-1])), dim=0)
+        self.C = int(self.res.prod())
+
+        ids = self._linear(self._cell(self.target)) + torch.arange(B, device=target.device).repeat_interleave(M)*self.C
+        ids, self.order = torch.sort(ids)
+        all_ids = torch.arange(B*self.C, device=target.device)
+        self.start = torch.searchsorted(ids, all_ids)
+        self.count = torch.searchsorted(ids, all_ids, right=True) - self.start
+
+    def _cell(self, x):
+        c = torch.floor((x - self.lo)/self.h).long()
+        return torch.max(torch.min(c, self.res - 1), torch.zeros_like(c))
+
+    def _linear(self, c):
+        return (c*self.strides).sum(-1)
+
+    def _shell(self, r):
+        # Cell offsets at Chebyshev distance exactly r, along the axes with
+        # more than one cell and within the extent of the grid
+        axes = [torch.arange(-min(r, k - 1), min(r, k - 1) + 1, device=self.res.device) for k in self.res.tolist()]
+        grid = torch.stack(torch.meshgrid(*axes, indexing='ij'), dim=-1).reshape(-1, self.d)
+        return grid[grid.abs().amax(dim=-1) == r]
+
+    def _cube(self, r):
+        # Number of cells within Chebyshev distance r, clamped to the grid
+        return int(torch.clamp(self.res, max=2*r + 1).prod())
+
+    def query(self, x, tile=65536, init=None):
+        """
+        x: (B, N, d) query points. Returns the index into M of the nearest
+        target of every query, (B, N). Queries are processed tile
+        (query, cell) pairs at a time. init: optional (B, N) guesses, e.g.
+        the matches of the previous iteration; cells farther than the guess
+        are never scanned, so good guesses make the search nearly free.
+
+        Queries still unresolved after a bounded number of cells (queries far
+        from a thin or small target) are finished by the tiled brute-force
+        search, which is cheaper from there on.
+        """
+        x = x.detach().to(self.target.dtype)
+        B, N, d = x.shape
+        x = x.reshape(B*N, d)
+        batch = torch.arange(B, device=x.device).repeat_interleave(N)
+        cell = self._cell(x)
+        if init is None:
+            best = torch.full((B*N,), float('inf'), device=x.device, dtype=x.dtype)
+            idx = torch.zeros(B*N, dtype=torch.long, device=x.device)
+        else:
+            idx = init.reshape(-1).to(x.device) + batch*self.M
+            best = ((x - self.target[idx])**2).sum(-1)
+        pending = torch.arange(B*N, device=x.device)
+
+        far = []
+        r = 0
+        while pending.numel() > 0:
+            if r >= MAX_RINGS or self._cube(r)*FALLBACK_RATIO > self.M:
+                far.append(pending)
+                break
+            shell = self._shell(r)
+            step = max(tile//shell.size(0), 1)
+            for s in range(0, pending.numel(), step):
+                q = pending[s:s+step]
+                nb = cell[q].unsqueeze(1) + shell
+                valid = ((nb >= 0) & (nb < self.res)).all(dim=-1)
+                cid = torch.where(valid, self._linear(nb) + (batch[q]*self.C).unsqueeze(1), torch.zeros_like(valid, dtype=torch.long))
+                # Skip cells that cannot beat the current best
+                box = self.lo + nb*self.h
+                gap = torch.max(box - x[q].unsqueeze(1), x[q].unsqueeze(1) - box - self.h).clamp(min=0)
+                valid = valid & ((gap*gap).sum(-1) <= best[q].unsqueeze(1))
+                cnt = torch.where(valid, self.count[cid], torch.zeros_like(cid)).reshape(-1)
+                if int(cnt.sum()) == 0:
+                    continue
+                # One entry per (query, candidate target) pair
+                owner = torch.repeat_interleave(torch.arange(cnt.numel(), device=x.device), cnt)
+                offset = torch.arange(owner.numel(), device=x.device) - (torch.cumsum(cnt, 0) - cnt)[owner]
+                cand = self.order[self.start[cid.reshape(-1)][owner] + offset]
+                qi = owner//shell.size(0)
+                dd = ((x[q[qi]] - self.target[cand])**2).sum(-1)
+                dmin = torch.full((q.numel(),), float('inf'), device=x.device, dtype=x.dtype).scatter_reduce(0, qi, dd, 'amin')
+                hit = dd == dmin[qi]
+                arg = torch.zeros(q.numel(), dtype=torch.long, device=x.device).scatter(0, qi[hit], cand[hit])
+                better = dmin < best[q]
+                best[q] = torch.where(better, dmin, best[q])
+                idx[q] = torch.where(better, arg, idx[q])
+
+            # Every unscanned target lies beyond one of the faces of the
+            # scanned cube; faces on the grid boundary have nothing behind them
+            c = cell[pending]
+            xp = x[pending]
+            below = torch.where(c - r > 0, xp - (self.lo + (c - r)*self.h), torch.full_like(xp, float('inf')))
+            above = torch.where(c + r + 1 < self.res, self.lo + (c + r + 1)*self.h - xp, torch.full_like(xp, float('inf')))
+            bound = torch.min(below.amin(dim=-1), above.amin(dim=-1))
+            done = (bound >= 0) & (best[pending] <= bound*bound)
+            pending = pending[~done]
+            # A finite best bounds the radius still to scan; queries whose
+            # cube would grow too large leave the grid search right away
+            rings = torch.ceil(best[pending].sqrt()/self.h).clamp(max=MAX_RINGS).long()
+            cube = torch.min(self.res, 2*rings.unsqueeze(-1) + 1).prod(dim=-1)
+            hopeless = torch.isfinite(best[pending]) & (cube*FALLBACK_RATIO > self.M)
+            far.append(pending[hopeless])
+            pending = pending[~hopeless]
+            r += 1
+
+        far = torch.cat(far)
+        for b in batch[far].unique().tolist():
+            q = far[batch[far] == b]
+            target = self.target[b*self.M:(b+1)*self.M].unsqueeze(0)
+            idx[q] = _tiled_argmin(x[q].unsqueeze(0), target, 2048)[0] + b*self.M
+        return (idx - batch*self.M).reshape(B, N)
+
+
+class TargetIndex(GridIndex):
+    """
+    GridIndex over a target cloud that stays fixed during an optimisation,
+    built once before the loop and queried every iteration. With
+    warm_start, the matches of the previous call seed the next search, so
+    when the prediction moves a little per step only the cells around the
+    previous match are scanned.
+
+    Only pred -> target (side=0) queries this index. target -> pred
+    (side=1) searches the prediction, which moves every step, so it
+    rebuilds a grid over pred each call and gains nothing from the target
+    being fixed beyond the warm start.
+    """
+    def __init__(self, target, points_per_cell=4, warm_start=True, tile=65536):
+        super(TargetIndex, self).__init__(target, points_per_cell)
+        self.points_per_cell = points_per_cell
+        self.warm_start = warm_start
+        self.tile = tile
+        self._forward = None
+        # Reverse indices point into pred: kept with the pred shape they index
+        self._reverse = None
+        self._reverse_shape = None
+
+    def _init(self, last, shape):
+        if self.warm_start and last is not None and last.shape == shape:
+            return last
+        return None
+
+    def query(self, x, tile=None, init=None):
+        if init is None:
+            init = self._init(self._forward, x.shape[:2])
+        idx = super(TargetIndex, self).query(x, tile or self.tile, init)
+        self._forward = idx
+        return idx
+
+    def nearest(self, pred):
+        # Squared distance from every pred point to the target, (B, N)
+        return nearest(pred, None, index=self)
+
+    def reverse_nearest(self, pred):
+        # Squared distance from every target point to pred, (B, M)
+        target = self.target.reshape(self.B, self.M, self.d).to(pred.dtype)
+        with torch.no_grad():
+            init = self._reverse if self._reverse_shape == pred.shape[:2] else None
+            init = self._init(init, target.shape[:2])
+            idx = GridIndex(pred, self.points_per_cell).query(target, self.tile, init)
+        self._reverse, self._reverse_shape = idx, pred.shape[:2]
+        near = torch.gather(pred, 1, idx.unsqueeze(-1).expand(-1, -1, pred.size(-1)))
+        return ((target - near)**2).sum(-1), idx
+
+    def chamfer_distance_one_side(self, pred, side=1):
+        # Same convention as chamfer_distance_one_side(pred, target, side)
+        d, _ = self.reverse_nearest(pred) if side == 1 else self.nearest(pred)
+        return d.mean(1).mean()
+
+    def chamfer_distance(self, pred, sqrt=False):
+        d_pred, _ = self.nearest(pred)
+        d_gt, _ = self.reverse_nearest(pred)
+        if sqrt:
+            d_pred, d_gt = d_pred.clamp(min=1e-10).sqrt(), d_gt.clamp(min=1e-10).sqrt()
+        return (d_pred.mean(1) + d_gt.mean(1)).mean()/2.0
+
+
+def _tiled_argmin(x, y, tile):
+    # Nearest y of every x with at most tile x tile distances alive at a time.
+    # Distances are taken from explicit differences: the matmul expansion
+    # cancels badly for points far from the origin and picks wrong neighbours.
+    B, N = x.shape[:2]
+    idx = torch.empty(B, N, dtype=torch.long, device=x.device)
+    for i in range(0, N, tile):
+        xi = x[:,i:i+tile]
+        best = torch.full(xi.shape[:2], float('inf'), device=x.device, dtype=x.dtype)
+        arg = torch.zeros(xi.shape[:2], dtype=torch.long, device=x.device)
+        for j in range(0, y.size(1), tile):
+            dmin, amin = torch.cdist(xi, y[:,j:j+tile], compute_mode='donot_use_mm_for_euclid_dist').min(dim=-1)
+            better = dmin < best
+            best = torch.where(better, dmin, best)
+            arg = torch.where(better, amin + j, arg)
+        idx[:,i:i+tile] = arg
+    return idx
+
+
+def nearest(x, y, method='tiled', tile=2048, index=None):
+    """
+    Squared distance from every point of x (B, N, d) to its nearest point of
+    y (B, M, d), and the index of that point, both (B, N).
+
+    The search runs without gradients, either tiled ('tiled', peak memory
+    B x tile x tile distances) or through a GridIndex ('grid', built on y
+    here unless a prebuilt index over y is passed). Distances are then
+    recomputed from the matched pairs, so they are differentiable w.r.t.
+    both x and y with the gradient of the exact nearest-neighbour distance.
+    y may be None when an index is given; the indexed targets are then
+    used as constants.
+    """
+    with torch.no_grad():
+        if index is not None:
+            idx = index.query(x)
+        elif method == 'grid':
+            idx = GridIndex(y).query(x)
+        else:
+            idx = _tiled_argmin(x.detach(), y.detach(), tile)
+    if y is None:
+        y = index.target.reshape(index.B, index.M, index.d).to(x.dtype)
+    near = torch.gather(y, 1, idx.unsqueeze(-1).expand(-1, -1, y.size(-1)))
+    return ((x - near)**2).sum(-1), idx
+
+
+def chamfer_distance_one_side(pred, gt, side=1, method='tiled', tile=2048, index=None):
+    """
+    Memory-bounded version of the one sided chamfer distance of the
+    examples. pred: B x N x d, gt: B x M x d. side=1 averages, over gt, the
+    squared distance to the nearest pred point; side=0 averages, over pred,
+    the squared distance to the nearest gt point. index: optional
+    GridIndex over the side searched (pred for side=1, gt for side=0).
+    """
+    if side == 0:
+        d, _ = nearest(pred, gt, method, tile, index)
+    else:
+        d, _ = nearest(gt, pred, method, tile, index)
+    return d.mean(1).mean()
+
+
+def chamfer_distance(pred, gt, sqrt=False, method='tiled', tile=2048, gt_index=None):
+    """
+    Memory-bounded symmetric chamfer distance, the mean of both one sided
+    terms. pred: B x N x d, gt: B x M x d. gt_index: optional GridIndex
+    over the static gt, reused for the pred -> gt term.
+    """
+    d_pred, _ = nearest(pred, gt, method, tile, gt_index)
+    d_gt, _ = nearest(gt, pred, method, tile)
+    if sqrt:
+        d_pred, d_gt = d_pred.clamp(min=1e-10).sqrt(), d_gt.clamp(min=1e-10).sqrt()
+    return (d_pred.mean(1) + d_gt.mean(1)).mean()/2.0
+
+
+def hausdorff_distance(pred, gt, method='tiled', tile=2048, gt_index=None):
+    """
+    Symmetric Hausdorff distance per batch element, (B,). The gradient
+    flows through the pair realising the maximum.
+    """
+    d_pred, _ = nearest(pred, gt, method, tile, gt_index)
+    d_gt, _ = nearest(gt, pred, method, tile)
+    return torch.max(d_pred.amax(1), d_gt.amax(1)).clamp(min=1e-20).sqrt()
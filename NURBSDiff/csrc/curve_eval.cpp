@@ -4,8 +4,34 @@
 #include <math.h>
 #include <algorithm>
 #include <vector>
+#include <ATen/Parallel.h>
+#include <ATen/OpMathType.h>
 #include "utils.h"
 
+#define CHECK_CPU(x) TORCH_CHECK(x.device().is_cpu(), #x " must be a CPU tensor")
+#define CHECK_SPAN(x) CHECK_CPU(x); TORCH_CHECK(x.scalar_type() == at::kInt, #x " must be an int32 tensor")
+
+// The kernels index raw buffers with the spans and _dimension, so every
+// shape they rely on is checked up front.
+static void check_curve_inputs(const torch::Tensor& ctrl_pts,
+    const torch::Tensor& uspan,
+    const torch::Tensor& Nu,
+    int64_t u_size,
+    int p,
+    int _dimension) {
+  TORCH_CHECK(ctrl_pts.dim() == 3, "ctrl_pts must be (B, m, dimension+1), got ", ctrl_pts.sizes());
+  TORCH_CHECK(ctrl_pts.size(2) == _dimension + 1, "ctrl_pts must have ", _dimension + 1,
+      " coordinates per point, got ", ctrl_pts.size(2));
+  TORCH_CHECK(uspan.numel() == u_size, "uspan must have ", u_size, " entries, got ", uspan.numel());
+  TORCH_CHECK(Nu.dim() == 2 && Nu.size(0) == u_size && Nu.size(1) == p + 1,
+      "Nu must be (", u_size, ", ", p + 1, "), got ", Nu.sizes());
+  if (u_size > 0) {
+    const int lo = uspan.min().item<int>();
+    const int hi = uspan.max().item<int>();
+    TORCH_CHECK(lo >= p && hi < ctrl_pts.size(1), "uspan spans [", lo, ", ", hi, "] do not fit ",
+        ctrl_pts.size(1), " control points of degree ", p);
+  }
+}
 
 std::vector<torch::Tensor> curve_pre_compute_basis(torch::Tensor u,
     torch::Tensor U,
@@ -14,31 +40,38 @@ std::vector<torch::Tensor> curve_pre_compute_basis(torch::Tensor u,
     int out_dim,
     int _dimension){
 
-  std::vector<int> uspan;
-  std::vector<torch::Tensor> Nu;
+  TORCH_CHECK(p <= pmax, "curve_pre_compute_basis supports degrees up to ", pmax);
+  CHECK_CPU(u); CHECK_CPU(U);
+  // Half and bfloat16 parameters are evaluated in float and the bases cast
+  // back, all other floating types natively
+  const auto dtype = u.scalar_type();
+  const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+  u = u.to(compute_dtype).contiguous();
+  U = U.to(compute_dtype).contiguous();
 
-  float* U_ptr = (float*)U.data_ptr();
-  auto options = torch::TensorOptions().dtype(torch::kInt);
+  const int u_size = u.size(0);
+  auto uspan_out = torch::empty({u_size}, torch::TensorOptions().dtype(torch::kInt));
+  auto Nu_out = torch::empty({u_size, p+1}, u.options());
 
+  AT_DISPATCH_FLOATING_TYPES(compute_dtype, "curve_pre_compute_basis", ([&] {
+    const scalar_t* u_ptr = u.data_ptr<scalar_t>();
+    scalar_t* U_ptr = U.data_ptr<scalar_t>();
+    int* uspan_ptr = uspan_out.data_ptr<int>();
+    scalar_t* Nu_ptr = Nu_out.data_ptr<scalar_t>();
 
-  for (int i = 0; i<u.size(0); i++)
-  {
-    auto uspan_u = find_span(m, p, u[i].item<float>(), U_ptr);
-    auto Nu_tensor = torch::zeros({p+1});
-    basis_funs(uspan_u, u[i].item<float>(), p, U_ptr, (float*)Nu_tensor.data_ptr());
-    uspan.push_back(uspan_u);
-    Nu.push_back(Nu_tensor);
-  }
+    at::parallel_for(0, u_size, 1024, [&](int64_t begin, int64_t end) {
+      basis_funs_batch(m, p, u_ptr + begin, end - begin, U_ptr, uspan_ptr + begin, Nu_ptr + begin*(p+1));
+    });
+  }));
 
-  int *uspan_ptr = &uspan[0];
-  auto uspan_out = torch::from_blob(uspan_ptr, torch::IntList(u.size(0)), options).clone();
-  auto Nu_out = torch::stack(Nu);
   return {uspan_out,
-          Nu_out};
+          Nu_out.to(dtype)};
 }
 
 
-torch::Tensor curve_forward(
+// Evaluates the homogeneous curve and applies the perspective division in
+// place. Returns {curves: (B, N, d), weights: (B, N)}.
+std::vector<torch::Tensor> curve_forward(
     torch::Tensor ctrl_pts,
     torch::Tensor uspan,
     torch::Tensor Nu,
@@ -46,58 +79,143 @@ torch::Tensor curve_forward(
     int m,
     int p,
     int _dimension) {
+  CHECK_CPU(ctrl_pts); CHECK_CPU(Nu); CHECK_SPAN(uspan);
+  check_curve_inputs(ctrl_pts, uspan, Nu, u.size(0), p, _dimension);
   // This is for a batch of control points as input and predicting a batch of curves
-  auto curve = torch::zeros({ctrl_pts.size(0), u.size(0), _dimension+1}, torch::requires_grad());
-  for (int k = 0; k<ctrl_pts.size(0); k++)
-  {
-    for (int i = 0; i<u.size(0); i++)
-    {
-      auto Cw = torch::zeros({_dimension+1});
-      for (int j = 0; j<=p; j++)
+  const auto dtype = ctrl_pts.scalar_type();
+  ctrl_pts = ctrl_pts.contiguous();
+  uspan = uspan.contiguous();
+  Nu = Nu.to(dtype).contiguous();
+
+  const int batch_size = ctrl_pts.size(0);
+  const int ctrl_size = ctrl_pts.size(1);
+  const int u_size = u.size(0);
+  const int dim = _dimension + 1;
+
+  auto curve = torch::empty({batch_size, u_size, _dimension}, ctrl_pts.options());
+  auto weight = torch::empty({batch_size, u_size}, ctrl_pts.options());
+
+  const int64_t grain_size = std::max<int64_t>(1, at::internal::GRAIN_SIZE/((int64_t)(p+1)*dim));
+
+  // Half and bfloat16 accumulate in float
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "curve_forward", ([&] {
+    using acc_t = at::opmath_type<scalar_t>;
+    const scalar_t* ctrl_ptr = ctrl_pts.data_ptr<scalar_t>();
+    const int* uspan_ptr = uspan.data_ptr<int>();
+    const scalar_t* Nu_ptr = Nu.data_ptr<scalar_t>();
+    scalar_t* curve_ptr = curve.data_ptr<scalar_t>();
+    scalar_t* weight_ptr = weight.data_ptr<scalar_t>();
+
+    at::parallel_for(0, (int64_t)batch_size*u_size, grain_size, [&](int64_t begin, int64_t end) {
+      std::vector<acc_t> Cw(dim);
+      for (int64_t point = begin; point<end; point++)
       {
-        Cw = Cw + Nu[i][j].item<float>()*ctrl_pts[k][uspan[i].item<int>() - p + j];
+        const int k = point/u_size;
+        const int i = point%u_size;
+        const scalar_t* N = Nu_ptr + i*(p+1);
+        const scalar_t* P = ctrl_ptr + ((int64_t)k*ctrl_size + uspan_ptr[i] - p)*dim;
+        std::fill(Cw.begin(), Cw.end(), acc_t(0));
+        for (int j = 0; j<=p; j++)
+        {
+          const acc_t N_j = N[j];
+          for (int d = 0; d<dim; d++)
+            Cw[d] += N_j*static_cast<acc_t>(P[j*dim + d]);
+        }
+        for (int d = 0; d<_dimension; d++)
+          curve_ptr[point*_dimension + d] = Cw[d]/Cw[_dimension];
+        weight_ptr[point] = Cw[_dimension];
       }
-      curve[k][i] = Cw;
-    }
-  }
-  return curve;
+    });
+  }));
+  return {curve, weight};
 }
 
 
+// Backward of curve_forward: applies the rational chain rule per point and
+// accumulates into the p+1 supporting control points only. Curves of the
+// batch are independent, so they are distributed across threads.
 std::vector<torch::Tensor> curve_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor curves,
+    torch::Tensor weights,
     torch::Tensor uspan,
     torch::Tensor Nu,
     torch::Tensor u,
     int m,
     int p,
     int _dimension) {
+  CHECK_CPU(grad_output); CHECK_CPU(ctrl_pts); CHECK_CPU(curves); CHECK_CPU(weights);
+  CHECK_CPU(Nu); CHECK_SPAN(uspan);
+  check_curve_inputs(ctrl_pts, uspan, Nu, u.size(0), p, _dimension);
+  const std::vector<int64_t> out_sizes = {ctrl_pts.size(0), u.size(0), _dimension};
+  TORCH_CHECK(grad_output.sizes() == at::IntArrayRef(out_sizes), "grad_output must be ",
+      at::IntArrayRef(out_sizes), ", got ", grad_output.sizes());
+  TORCH_CHECK(curves.sizes() == grad_output.sizes() && weights.numel() == curves.numel()/_dimension,
+      "curves and weights must be the outputs of forward");
+
+  const auto dtype = grad_output.scalar_type();
+  grad_output = grad_output.contiguous();
+  curves = curves.to(dtype).contiguous();
+  weights = weights.to(dtype).contiguous();
+  uspan = uspan.contiguous();
+  Nu = Nu.to(dtype).contiguous();
+
+  const int batch_size = grad_output.size(0);
+  const int ctrl_size = ctrl_pts.size(1);
+  const int u_size = u.size(0);
+  const int dim = _dimension + 1;
 
-  auto grad_ctrl_pts = torch::zeros_like(ctrl_pts);
+  // Half and bfloat16 gradients are accumulated in float
+  auto grad_ctrl_pts = torch::zeros({batch_size, ctrl_size, dim}, grad_output.options().dtype(at::toOpMathType(dtype)));
 
-  // std::cout << uspan.size(0)<< Nu.size(1) << std::endl;
-  for (int k=0; k<grad_output.size(0); k++)
-  {
-    for (int i=0; i<u.size(0); i++)
-    {
-      auto grad_cw = grad_output[k];
-      auto grad_ctrl_pts_i = torch::zeros_like(ctrl_pts[k]);
-      for (int j = 0; j<=p; j++)
+  const int64_t grain_size = std::max<int64_t>(1, at::internal::GRAIN_SIZE/((int64_t)u_size*(p+1)*dim));
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "curve_backward", ([&] {
+    using acc_t = at::opmath_type<scalar_t>;
+    const scalar_t* grad_ptr = grad_output.data_ptr<scalar_t>();
+    const scalar_t* curve_ptr = curves.data_ptr<scalar_t>();
+    const scalar_t* weight_ptr = weights.data_ptr<scalar_t>();
+    const int* uspan_ptr = uspan.data_ptr<int>();
+    const scalar_t* Nu_ptr = Nu.data_ptr<scalar_t>();
+    acc_t* grad_ctrl_ptr = grad_ctrl_pts.data_ptr<acc_t>();
+
+    at::parallel_for(0, batch_size, grain_size, [&](int64_t begin, int64_t end) {
+      std::vector<acc_t> grad_cw(dim);
+      for (int64_t k = begin; k<end; k++)
       {
-        // std::cout << k << " "<< j << " " << i << " " << uspan[i].item<int>() - p + j << Nu[i][j].item<float>() << grad_cw[i]<< std::endl;
-        grad_ctrl_pts_i[uspan[i].item<int>() - p + j] = grad_ctrl_pts_i[uspan[i].item<int>() - p + j] + Nu[i][j].item<float>()*grad_cw[i];
+        acc_t* G = grad_ctrl_ptr + k*ctrl_size*dim;
+        for (int i = 0; i<u_size; i++)
+        {
+          const int64_t point = k*u_size + i;
+          const scalar_t* g = grad_ptr + point*_dimension;
+          const scalar_t* C = curve_ptr + point*_dimension;
+          const acc_t w = weight_ptr[point];
+          grad_cw[_dimension] = 0;
+          for (int d = 0; d<_dimension; d++)
+          {
+            grad_cw[d] = static_cast<acc_t>(g[d])/w;
+            grad_cw[_dimension] -= grad_cw[d]*static_cast<acc_t>(C[d]);
+          }
+
+          const scalar_t* N = Nu_ptr + i*(p+1);
+          acc_t* G_i = G + (uspan_ptr[i] - p)*dim;
+          for (int j = 0; j<=p; j++)
+          {
+            const acc_t N_j = N[j];
+            for (int d = 0; d<dim; d++)
+              G_i[j*dim + d] += N_j*grad_cw[d];
+          }
+        }
       }
-      grad_ctrl_pts[k] = (grad_ctrl_pts[k] + grad_ctrl_pts_i);
-    }
-  }
-  
+    });
+  }));
 
-  return {grad_ctrl_pts};
+  return {grad_ctrl_pts.to(dtype)};
 }
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
   m.def("pre_compute_basis", &curve_pre_compute_basis, "Pre-Compute Basis");
   m.def("forward", &curve_forward, "forward func for curve eval");
-  m.def("backward", &curve_backward, "forward func for curve eval");
+  m.def("backward", &curve_backward, "backward func for curve eval");
 }
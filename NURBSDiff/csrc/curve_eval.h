@@ -9,7 +9,7 @@ std::vector<at::Tensor> curve_pre_compute_basis(at::Tensor u,
     int out_dim,
     int _dimension);
 
-at::Tensor curve_forward(
+std::vector<at::Tensor> curve_forward(
     at::Tensor ctrl_pts,
     at::Tensor uspan,
     at::Tensor Nu,
@@ -21,6 +21,8 @@ at::Tensor curve_forward(
 std::vector<at::Tensor> curve_backward(
     at::Tensor grad_output,
     at::Tensor ctrl_pts,
+    at::Tensor curves,
+    at::Tensor weights,
     at::Tensor uspan,
     at::Tensor Nu,
     at::Tensor u,
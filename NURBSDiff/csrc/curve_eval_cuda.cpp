@@ -16,7 +16,7 @@ std::vector<torch::Tensor> curve_cuda_pre_compute_basis(
     int _dimension);
 
 
-torch::Tensor curve_cuda_forward(
+std::vector<torch::Tensor> curve_cuda_forward(
     torch::Tensor ctrl_pts,
     torch::Tensor uspan,
     torch::Tensor Nu,
@@ -29,6 +29,8 @@ torch::Tensor curve_cuda_forward(
 std::vector<torch::Tensor> curve_cuda_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor curves,
+    torch::Tensor weights,
     torch::Tensor uspan,
     torch::Tensor Nu,
     torch::Tensor u,
@@ -64,7 +66,7 @@ return curve_cuda_pre_compute_basis(u,U,m,p,out_dim,_dimension);
 
 
 
-torch::Tensor curve_forward(
+std::vector<torch::Tensor> curve_forward(
     torch::Tensor ctrl_pts,
     torch::Tensor uspan,
     torch::Tensor Nu,
@@ -85,6 +87,8 @@ return curve_cuda_forward(ctrl_pts,uspan,Nu,u,m,p,_dimension);
 std::vector<torch::Tensor> curve_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor curves,
+    torch::Tensor weights,
     torch::Tensor uspan,
     torch::Tensor Nu,
     torch::Tensor u,
@@ -95,10 +99,12 @@ std::vector<torch::Tensor> curve_backward(
 {
 CHECK_INPUT(grad_output);
 CHECK_INPUT(ctrl_pts);
+CHECK_INPUT(curves);
+CHECK_INPUT(weights);
 CHECK_INPUT(uspan);
 CHECK_INPUT(Nu);
 CHECK_INPUT(u);
-return curve_cuda_backward(grad_output,ctrl_pts,uspan,Nu,u,m,p,_dimension);
+return curve_cuda_backward(grad_output,ctrl_pts,curves,weights,uspan,Nu,u,m,p,_dimension);
 }
 
 
@@ -3,6 +3,8 @@
 
 #include <cuda.h>
 #include <cuda_runtime.h>
+#include <ATen/OpMathType.h>
+#include <ATen/cuda/Atomic.cuh>
 
 
 #include <vector>
@@ -11,7 +13,8 @@
 
 namespace {
 
-__device__ __forceinline__ int find_span(int n, int p, float u, float* U) 
+template <typename scalar_t>
+__device__ __forceinline__ int find_span(int n, int p, scalar_t u, scalar_t* U)
 {
 
       double eps = 1.0e-5;
@@ -31,11 +34,12 @@ __device__ __forceinline__ int find_span(int n, int p, float u, float* U)
 }
 
 
-__device__ __forceinline__ void basis_funs(int uspan_i, float u, int p, float* U, float* N, unsigned int i)
+template <typename scalar_t>
+__device__ __forceinline__ void basis_funs(int uspan_i, scalar_t u, int p, scalar_t* U, scalar_t* N, unsigned int i)
 {
-  float *left  = new float [p+1];
-  float *right = new float [p+1];
-  float saved, temp;
+  scalar_t *left  = new scalar_t [p+1];
+  scalar_t *right = new scalar_t [p+1];
+  scalar_t saved, temp;
   int col = p + 1;
   N[i*col] = 1.0;
   for (int j=1; j<=p; j++){
@@ -51,18 +55,20 @@ __device__ __forceinline__ void basis_funs(int uspan_i, float u, int p, float* U
 
     N[i*col+j] = saved;
 }
+  delete [] left;
+  delete [] right;
 
 }
 
 
 
 
+template <typename scalar_t>
 __global__ void curve_cuda_pre_compute_basis_kernel(
     torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
-    // torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-    torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-    float* U_ptr,
-    float* Nu_ptr,
+    torch::PackedTensorAccessor<scalar_t,1,torch::RestrictPtrTraits,size_t> u,
+    scalar_t* U_ptr,
+    scalar_t* Nu_ptr,
     int m, 
     int p, 
     int out_dim, 
@@ -87,77 +93,75 @@ __global__ void curve_cuda_pre_compute_basis_kernel(
   }
 
 
+template <typename scalar_t>
 __global__ void curve_cuda_forward_kernel(
-  torch::PackedTensorAccessor<float,3,torch::RestrictPtrTraits,size_t> ctrl_pts,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> ctrl_pts,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-  torch::PackedTensorAccessor<float,3,torch::RestrictPtrTraits,size_t> curves,
-  // int* uspan,
-  // float* Nu,
-  int m,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nu,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> curves,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> weights,
   int p,
   int _dimension,
   unsigned int ctrl_pts_size,
   unsigned int u_size){
 
+  using acc_t = at::opmath_type<scalar_t>;
   unsigned int k = blockIdx.x * blockDim.x + threadIdx.x;
   unsigned int i = blockIdx.y * blockDim.y + threadIdx.y;
-  // unsigned int l = blockIdx.z * blockDim.z + threadIdx.z;cd t
-  // std::printf("Hello from k %d, i %d, l %d\n", k,i,l);
-
-
-  if(k < ctrl_pts_size)
-  { 
-    if (i < u_size)
-    { 
-      for(int l = 0; l <= _dimension; l++)
-      { 
-        for (int j = 0; j<=p; j++)
-        {
-          curves[k][i][l] +=  Nu[i][j]*ctrl_pts[k][uspan[i]-p + j][l];
-        }
-      }
+
+  if(k < ctrl_pts_size && i < u_size)
+  {
+    acc_t w = 0.0;
+    for (int j = 0; j<=p; j++)
+      w += static_cast<acc_t>(Nu[i][j])*static_cast<acc_t>(ctrl_pts[k][uspan[i]-p + j][_dimension]);
+    for(int l = 0; l < _dimension; l++)
+    {
+      acc_t c = 0.0;
+      for (int j = 0; j<=p; j++)
+        c += static_cast<acc_t>(Nu[i][j])*static_cast<acc_t>(ctrl_pts[k][uspan[i]-p + j][l]);
+      curves[k][i][l] = c/w;
     }
+    weights[k][i] = w;
   }
  }
 
 
 
 
+ // Atomics always act on the float or double accumulation buffer
+ template <typename scalar_t>
  __global__ void curve_cuda_backward_kernel(
-  torch::PackedTensorAccessor<float,3,torch::RestrictPtrTraits,size_t> grad_ctrl_pts,
-  torch::PackedTensorAccessor<float,3,torch::RestrictPtrTraits,size_t> grad_output,
+  torch::PackedTensorAccessor<at::opmath_type<scalar_t>,3,torch::RestrictPtrTraits,size_t> grad_ctrl_pts,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> grad_output,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> curves,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> weights,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-  int m, 
-  int p,  
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nu,
+  int p,
   int _dimension,
   unsigned int curves_size,
   unsigned u_size){
 
+  using acc_t = at::opmath_type<scalar_t>;
   unsigned int k = blockIdx.x * blockDim.x + threadIdx.x;
   unsigned int i = blockIdx.y * blockDim.y + threadIdx.y;
-  // unsigned int l = blockIdx.z * blockDim.z + threadIdx.z;cd t
-  // std::printf("Hello from k %d, i %d, l %d\n", k,i,l);
-
-
-  if(k < curves_size)
-  { 
-    if (i < u_size)
-    { 
-      for(int l = 0; l <= _dimension; l++)
-      { 
-        for (int j = 0; j <= p; j++)
-        {
-          grad_ctrl_pts[k][uspan[i]-p+j][l] += Nu[i][j]*grad_output[k][i][l];
-        }
-      }
+
+  if(k < curves_size && i < u_size)
+  {
+    const acc_t w = weights[k][i];
+    acc_t grad_w = 0.0;
+    for(int l = 0; l < _dimension; l++)
+    {
+      const acc_t g = static_cast<acc_t>(grad_output[k][i][l])/w;
+      grad_w -= g*static_cast<acc_t>(curves[k][i][l]);
+      for (int j = 0; j <= p; j++)
+        gpuAtomicAdd(&grad_ctrl_pts[k][uspan[i]-p+j][l], static_cast<acc_t>(Nu[i][j])*g);
     }
+    for (int j = 0; j <= p; j++)
+      gpuAtomicAdd(&grad_ctrl_pts[k][uspan[i]-p+j][_dimension], static_cast<acc_t>(Nu[i][j])*grad_w);
   }
  }
-   
+
 
 
 
@@ -179,39 +183,40 @@ std::vector<torch::Tensor> curve_cuda_pre_compute_basis(
   int out_dim,
   int _dimension){
 
-  float* U_ptr = (float*)U.data_ptr();
-  auto options1 = torch::TensorOptions().dtype(torch::kInt32).device(torch::kCUDA, 0).requires_grad(false);
-  auto options2 = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-  
-  // auto device = torch::device(torch::kCUDA, 1);
+  // Half and bfloat16 parameters are evaluated in float and the bases cast back
+  const auto dtype = u.scalar_type();
+  const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+  u = u.to(compute_dtype).contiguous();
+  U = U.to(compute_dtype).contiguous();
+
+  auto options1 = torch::TensorOptions().dtype(torch::kInt32).device(u.device()).requires_grad(false);
+
   auto uspan = torch::zeros(u.size(0), options1);
-  auto Nu = torch::zeros({u.size(0), p + 1}, options2);
-  float* Nu_ptr = (float*)Nu.data_ptr();
+  auto Nu = torch::zeros({u.size(0), p + 1}, u.options());
 
   int u_size = u.size(0);
 
   const dim3 block(1, 1, 1);
   const dim3 grid(u_size+1, 1, 1);
 
-  // AT_DISPATCH_FLOATING_TYPES(u.type(), "curve_cuda_pre_compute", ([&] {
-    curve_cuda_pre_compute_basis_kernel<<<grid, block>>>(
+  AT_DISPATCH_FLOATING_TYPES(compute_dtype, "curve_cuda_pre_compute_basis", ([&] {
+    curve_cuda_pre_compute_basis_kernel<scalar_t><<<grid, block>>>(
         uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-        // Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-        u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-        U_ptr,
-        Nu_ptr,
-        m, 
-        p, 
-        out_dim, 
+        u.packed_accessor<scalar_t,1,torch::RestrictPtrTraits,size_t>(),
+        U.data_ptr<scalar_t>(),
+        Nu.data_ptr<scalar_t>(),
+        m,
+        p,
+        out_dim,
         _dimension,
         u_size);
-  // }));
-    return {uspan, Nu};
-  
+  }));
+    return {uspan, Nu.to(dtype)};
+
   }
 
 
-torch::Tensor curve_cuda_forward(
+std::vector<torch::Tensor> curve_cuda_forward(
   torch::Tensor ctrl_pts,
   torch::Tensor uspan,
   torch::Tensor Nu,
@@ -219,12 +224,11 @@ torch::Tensor curve_cuda_forward(
   int m,
   int p,
   int _dimension){
-  
-  auto options = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
 
-  // float* Nu_ptr = (float*)Nu.data_ptr();
-  // int* uspan_ptr = (int*)uspan.data_ptr();
-  auto curves = torch::zeros({ctrl_pts.size(0),u.size(0), _dimension+1}, options);
+  const auto dtype = ctrl_pts.scalar_type();
+  Nu = Nu.to(dtype);
+  auto curves = torch::empty({ctrl_pts.size(0), u.size(0), _dimension}, ctrl_pts.options());
+  auto weights = torch::empty({ctrl_pts.size(0), u.size(0)}, ctrl_pts.options());
   unsigned int ctrl_pts_size = ctrl_pts.size(0);
   unsigned int u_size = u.size(0);
 
@@ -232,20 +236,21 @@ torch::Tensor curve_cuda_forward(
   const dim3 grid((ctrl_pts_size)/16+1, (u_size)/16+1, 1);
 
 
-  curve_cuda_forward_kernel<<<grid, block>>>(
-    ctrl_pts.packed_accessor<float,3,torch::RestrictPtrTraits,size_t>(),
-    uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-    Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-    u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-    curves.packed_accessor<float,3,torch::RestrictPtrTraits,size_t>(),
-    m, 
-    p,  
-    _dimension,
-    ctrl_pts_size,
-    u_size);
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "curve_cuda_forward", ([&] {
+    curve_cuda_forward_kernel<scalar_t><<<grid, block>>>(
+      ctrl_pts.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
+      uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
+      Nu.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      curves.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
+      weights.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      p,
+      _dimension,
+      ctrl_pts_size,
+      u_size);
+  }));
 
 
-    return curves;
+    return {curves, weights};
 
   }
 
@@ -253,6 +258,8 @@ torch::Tensor curve_cuda_forward(
 std::vector<torch::Tensor> curve_cuda_backward(
   torch::Tensor grad_output,
   torch::Tensor ctrl_pts,
+  torch::Tensor curves,
+  torch::Tensor weights,
   torch::Tensor uspan,
   torch::Tensor Nu,
   torch::Tensor u,
@@ -261,8 +268,12 @@ std::vector<torch::Tensor> curve_cuda_backward(
   int _dimension)
   {
 
-  auto options = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-  auto grad_ctrl_pts = torch::zeros({ctrl_pts.size(0),ctrl_pts.size(1), _dimension+1}, options);
+  const auto dtype = grad_output.scalar_type();
+  curves = curves.to(dtype);
+  weights = weights.to(dtype);
+  Nu = Nu.to(dtype);
+  // Half and bfloat16 gradients are accumulated in float
+  auto grad_ctrl_pts = torch::zeros({ctrl_pts.size(0),ctrl_pts.size(1), _dimension+1}, grad_output.options().dtype(at::toOpMathType(dtype)));
   unsigned int curves_size = ctrl_pts.size(0);
   unsigned int u_size = u.size(0);
 
@@ -271,19 +282,21 @@ std::vector<torch::Tensor> curve_cuda_backward(
   const dim3 grid((curves_size)/16+1, (u_size)/16+1, 1);
 
 
-  curve_cuda_backward_kernel<<<grid, block>>>(
-    grad_ctrl_pts.packed_accessor<float,3,torch::RestrictPtrTraits,size_t>(),
-    grad_output.packed_accessor<float,3,torch::RestrictPtrTraits,size_t>(),
-    uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-    Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-    u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-    m, 
-    p,  
-    _dimension,
-    curves_size,
-    u_size);
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "curve_cuda_backward", ([&] {
+    curve_cuda_backward_kernel<scalar_t><<<grid, block>>>(
+      grad_ctrl_pts.packed_accessor<at::opmath_type<scalar_t>,3,torch::RestrictPtrTraits,size_t>(),
+      grad_output.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
+      curves.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
+      weights.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
+      Nu.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      p,
+      _dimension,
+      curves_size,
+      u_size);
+  }));
 
-  return {grad_ctrl_pts};
+  return {grad_ctrl_pts.to(dtype)};
 
 
-  }
\ No newline at end of file
+  }
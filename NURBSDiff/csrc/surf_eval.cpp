@@ -4,8 +4,47 @@
 #include <math.h>
 #include <algorithm>
 #include <vector>
+#include <ATen/Parallel.h>
+#include <ATen/OpMathType.h>
 #include "utils.h"
 
+#define CHECK_CPU(x) TORCH_CHECK(x.device().is_cpu(), #x " must be a CPU tensor")
+#define CHECK_SPAN(x) CHECK_CPU(x); TORCH_CHECK(x.scalar_type() == at::kInt, #x " must be an int32 tensor")
+
+
+// The kernels index raw buffers with the spans and _dimension, so every
+// shape they rely on is checked up front.
+static void check_spans(const torch::Tensor& span, int p, int64_t ctrl, const char* name) {
+  if (span.numel() == 0)
+    return;
+  const int lo = span.min().item<int>();
+  const int hi = span.max().item<int>();
+  TORCH_CHECK(lo >= p && hi < ctrl, name, " spans [", lo, ", ", hi, "] do not fit ", ctrl,
+      " control points of degree ", p);
+}
+
+static void check_surf_inputs(const torch::Tensor& ctrl_pts,
+    const torch::Tensor& uspan_uv,
+    const torch::Tensor& vspan_uv,
+    const torch::Tensor& Nu_uv,
+    const torch::Tensor& Nv_uv,
+    int64_t u_size,
+    int64_t v_size,
+    int p,
+    int q,
+    int _dimension) {
+  TORCH_CHECK(ctrl_pts.dim() == 4, "ctrl_pts must be (B, m, n, dimension+1), got ", ctrl_pts.sizes());
+  TORCH_CHECK(ctrl_pts.size(3) == _dimension + 1, "ctrl_pts must have ", _dimension + 1,
+      " coordinates per point, got ", ctrl_pts.size(3));
+  TORCH_CHECK(uspan_uv.numel() == u_size && vspan_uv.numel() == v_size, "uspan_uv and vspan_uv must have ",
+      u_size, " and ", v_size, " entries");
+  TORCH_CHECK(Nu_uv.dim() == 2 && Nu_uv.size(0) == u_size && Nu_uv.size(1) == p + 1,
+      "Nu_uv must be (", u_size, ", ", p + 1, "), got ", Nu_uv.sizes());
+  TORCH_CHECK(Nv_uv.dim() == 2 && Nv_uv.size(0) == v_size && Nv_uv.size(1) == q + 1,
+      "Nv_uv must be (", v_size, ", ", q + 1, "), got ", Nv_uv.sizes());
+  check_spans(uspan_uv, p, ctrl_pts.size(1), "uspan_uv");
+  check_spans(vspan_uv, q, ctrl_pts.size(2), "vspan_uv");
+}
 
 std::vector<torch::Tensor> surf_pre_compute_basis(torch::Tensor u,
     torch::Tensor v,
@@ -18,106 +57,56 @@ std::vector<torch::Tensor> surf_pre_compute_basis(torch::Tensor u,
     int out_dim,
     int _dimension){
 
+  TORCH_CHECK(p <= pmax && q <= pmax, "surf_pre_compute_basis supports degrees up to ", pmax);
+  CHECK_CPU(u); CHECK_CPU(v); CHECK_CPU(U); CHECK_CPU(V);
+  // Half and bfloat16 parameters are evaluated in float and the bases cast
+  // back, all other floating types natively
+  const auto dtype = u.scalar_type();
+  const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+  u = u.to(compute_dtype).contiguous();
+  v = v.to(compute_dtype).contiguous();
+  U = U.to(compute_dtype).contiguous();
+  V = V.to(compute_dtype).contiguous();
+
+  const int u_size = u.size(0);
+  const int v_size = v.size(0);
+  auto int_options = torch::TensorOptions().dtype(torch::kInt);
 
-  std::vector<int> uspan;
-  std::vector<torch::Tensor> Nu;
-
-  std::vector<int> vspan;
-  std::vector<torch::Tensor> Nv;
-
-  // std::vector<torch::Tensor> uspan_uv;
-  // std::vector<torch::Tensor> vspan_uv;
-  // std::vector<torch::Tensor> Nu_uv;
-  // std::vector<torch::Tensor> Nv_uv;
-
-  float* U_ptr = (float*)U.data_ptr();
-  float* V_ptr = (float*)V.data_ptr();
-  auto options = torch::TensorOptions().dtype(torch::kInt);
-
-  for (int i = 0; i<u.size(0); i++)
-  {
-    auto uspan_u = find_span(m, p, u[i].item<float>(), U_ptr);
-    auto Nu_tensor = torch::zeros({p+1});
-    basis_funs(uspan_u, u[i].item<float>(), p, U_ptr, (float*)Nu_tensor.data_ptr());
-    uspan.push_back(uspan_u);
-    Nu.push_back(Nu_tensor);
-  }
-
-
-  for (int j = 0; j<v.size(0); j++)
-  {
-    auto vspan_v = find_span(n, q, v[j].item<float>(), V_ptr);
-    auto Nv_tensor = torch::zeros({q+1});
-    basis_funs(vspan_v, v[j].item<float>(), q, V_ptr, (float*)Nv_tensor.data_ptr());
-    vspan.push_back(vspan_v);
-    Nv.push_back(Nv_tensor);
-  }
-
-
-
-  int *uspan_ptr = &uspan[0];
-  auto uspan_out = torch::from_blob(uspan_ptr, torch::IntList(u.size(0)), options).clone();
-  auto Nu_out = torch::stack(Nu);
-
-  int *vspan_ptr = &vspan[0];
-  auto vspan_out = torch::from_blob(vspan_ptr, torch::IntList(v.size(0)), options).clone();
-  auto Nv_out = torch::stack(Nv);
-
-
-
-
-  // for (int i = 0; i<u.size(0); i++)
-  // {
-  //   std::vector<int> uspan_v;
-  //   std::vector<int> vspan_v;
-  //   std::vector<torch::Tensor> Nu_v;
-  //   std::vector<torch::Tensor> Nv_v;
-
-
-  //   auto Nu_tensor = torch::zeros({p+1});
-  //   auto uspan = find_span(n, p, u[i].item<float>(), U_ptr);
-  //   basis_funs(uspan, u[i].item<float>(), p, U_ptr, (float*)Nu_tensor.data_ptr());
-    
-  //   for (auto j=0; j<v.size(0); j++)
-  //   {
-      
-  //     auto vspan = find_span(m, q, v[j].item<float>(), V_ptr);
-      
-  //     auto Nv_tensor = torch::zeros({q+1});
-      
-  //     basis_funs(vspan, v[j].item<float>(), q, V_ptr, (float*)Nv_tensor.data_ptr());
-  //     uspan_v.push_back(uspan);
-  //     vspan_v.push_back(vspan);
-  //     Nu_v.push_back(Nu_tensor);
-  //     Nv_v.push_back(Nv_tensor);
-  //   }
-  //   int *uspan_v_ptr = &uspan_v[0];
-  //   int *vspan_v_ptr = &vspan_v[0];
-  //   auto uspan_v_tensor = torch::from_blob(uspan_v_ptr, torch::IntList(v.size(0)), options).clone();
-  //   auto vspan_v_tensor = torch::from_blob(vspan_v_ptr, torch::IntList(v.size(0)), options).clone();
-  //   auto Nu_v_tensor = torch::stack(Nu_v);
-  //   auto Nv_v_tensor = torch::stack(Nv_v);
-  //   uspan_uv.push_back(uspan_v_tensor);
-  //   vspan_uv.push_back(vspan_v_tensor);
-  //   Nu_uv.push_back(Nu_v_tensor);
-  //   Nv_uv.push_back(Nv_v_tensor);
-  // }
-
-  // auto uspan_uv_tensor = torch::stack(uspan_uv);
-  // auto vspan_uv_tensor = torch::stack(vspan_uv);
-  // auto Nu_uv_tensor = torch::stack(Nu_uv);
-  // auto Nv_uv_tensor = torch::stack(Nv_uv);
+  // One allocation per output; every parameter is independent, so chunks of
+  // the parameter arrays are evaluated in parallel straight into them.
+  auto uspan_out = torch::empty({u_size}, int_options);
+  auto vspan_out = torch::empty({v_size}, int_options);
+  auto Nu_out = torch::empty({u_size, p+1}, u.options());
+  auto Nv_out = torch::empty({v_size, q+1}, u.options());
 
+  AT_DISPATCH_FLOATING_TYPES(compute_dtype, "surf_pre_compute_basis", ([&] {
+    const scalar_t* u_ptr = u.data_ptr<scalar_t>();
+    const scalar_t* v_ptr = v.data_ptr<scalar_t>();
+    scalar_t* U_ptr = U.data_ptr<scalar_t>();
+    scalar_t* V_ptr = V.data_ptr<scalar_t>();
+    int* uspan_ptr = uspan_out.data_ptr<int>();
+    int* vspan_ptr = vspan_out.data_ptr<int>();
+    scalar_t* Nu_ptr = Nu_out.data_ptr<scalar_t>();
+    scalar_t* Nv_ptr = Nv_out.data_ptr<scalar_t>();
 
+    at::parallel_for(0, u_size, 1024, [&](int64_t begin, int64_t end) {
+      basis_funs_batch(m, p, u_ptr + begin, end - begin, U_ptr, uspan_ptr + begin, Nu_ptr + begin*(p+1));
+    });
+    at::parallel_for(0, v_size, 1024, [&](int64_t begin, int64_t end) {
+      basis_funs_batch(n, q, v_ptr + begin, end - begin, V_ptr, vspan_ptr + begin, Nv_ptr + begin*(q+1));
+    });
+  }));
 
   return {uspan_out,
           vspan_out,
-          Nu_out,
-          Nv_out};
+          Nu_out.to(dtype),
+          Nv_out.to(dtype)};
 }
 
 
-torch::Tensor surf_forward(
+// Evaluates the homogeneous surface and applies the perspective division in
+// place. Returns {surfaces: (B, U, V, d), weights: (B, U, V)}.
+std::vector<torch::Tensor> surf_forward(
     torch::Tensor ctrl_pts,
     torch::Tensor uspan_uv,
     torch::Tensor vspan_uv,
@@ -130,33 +119,94 @@ torch::Tensor surf_forward(
     int p,
     int q,
     int _dimension) {
-  auto surface = torch::zeros({ctrl_pts.size(0), u_uv.size(0), v_uv.size(0), _dimension+1}, torch::requires_grad());
-  for (int k = 0; k<ctrl_pts.size(0); k++)
-  {
-    for (int j = 0; j<v_uv.size(0); j++)
-    {
-      for (int i = 0; i<u_uv.size(0); i++)
+  CHECK_CPU(ctrl_pts); CHECK_CPU(Nu_uv); CHECK_CPU(Nv_uv);
+  CHECK_SPAN(uspan_uv); CHECK_SPAN(vspan_uv);
+  check_surf_inputs(ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv.size(0), v_uv.size(0), p, q, _dimension);
+  // Work on raw contiguous buffers: no per-point tensor allocation and no
+  // dispatcher round trips for spans and basis values. Every floating type is
+  // supported; half and bfloat16 accumulate in float.
+  const auto dtype = ctrl_pts.scalar_type();
+  ctrl_pts = ctrl_pts.contiguous();
+  uspan_uv = uspan_uv.contiguous();
+  vspan_uv = vspan_uv.contiguous();
+  Nu_uv = Nu_uv.to(dtype).contiguous();
+  Nv_uv = Nv_uv.to(dtype).contiguous();
+
+  const int batch_size = ctrl_pts.size(0);
+  const int ctrl_u = ctrl_pts.size(1);
+  const int ctrl_v = ctrl_pts.size(2);
+  const int u_size = u_uv.size(0);
+  const int v_size = v_uv.size(0);
+  const int dim = _dimension + 1;
+
+  auto surface = torch::empty({batch_size, u_size, v_size, _dimension}, ctrl_pts.options());
+  auto weight = torch::empty({batch_size, u_size, v_size}, ctrl_pts.options());
+
+  const int64_t ctrl_row = (int64_t)ctrl_v*dim;
+  // Every (batch, u-row) pair writes a disjoint slab of the output, so the
+  // rows are split across the ATen intra-op thread pool.
+  const int64_t row_cost = (int64_t)v_size*(p+1)*(q+1)*dim;
+  const int64_t grain_size = std::max<int64_t>(1, at::internal::GRAIN_SIZE/std::max<int64_t>(1, row_cost));
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "surf_forward", ([&] {
+    using acc_t = at::opmath_type<scalar_t>;
+    const scalar_t* ctrl_ptr = ctrl_pts.data_ptr<scalar_t>();
+    const int* uspan_ptr = uspan_uv.data_ptr<int>();
+    const int* vspan_ptr = vspan_uv.data_ptr<int>();
+    const scalar_t* Nu_ptr = Nu_uv.data_ptr<scalar_t>();
+    const scalar_t* Nv_ptr = Nv_uv.data_ptr<scalar_t>();
+    scalar_t* surface_ptr = surface.data_ptr<scalar_t>();
+    scalar_t* weight_ptr = weight.data_ptr<scalar_t>();
+
+    at::parallel_for(0, (int64_t)batch_size*u_size, grain_size, [&](int64_t begin, int64_t end) {
+      std::vector<acc_t> temp(dim);
+      std::vector<acc_t> Sw(dim);
+      for (int64_t row = begin; row<end; row++)
       {
-        auto temp = torch::zeros({q+1, _dimension+1});
-        auto Sw = torch::zeros({_dimension+1});
-        for (int l = 0; l<=q; l++)
+        const int k = row/u_size;
+        const int i = row%u_size;
+        const scalar_t* P = ctrl_ptr + (int64_t)k*ctrl_u*ctrl_row;
+        const scalar_t* Nu = Nu_ptr + i*(p+1);
+        const scalar_t* P_i = P + (int64_t)(uspan_ptr[i] - p)*ctrl_row;
+        for (int j = 0; j<v_size; j++)
         {
-          for (int r = 0; r<=p; r++)
+          const scalar_t* Nv = Nv_ptr + j*(q+1);
+          const int col = vspan_ptr[j] - q;
+          std::fill(Sw.begin(), Sw.end(), acc_t(0));
+          for (int l = 0; l<=q; l++)
           {
-            temp[l] = temp[l] + Nu_uv[i][r].item<float>()*ctrl_pts[k][uspan_uv[i].item<int>() - p + r][vspan_uv[j].item<int>() - q + l];
+            std::fill(temp.begin(), temp.end(), acc_t(0));
+            for (int r = 0; r<=p; r++)
+            {
+              const scalar_t* Pw = P_i + r*ctrl_row + (col + l)*dim;
+              const acc_t Nu_r = Nu[r];
+              for (int d = 0; d<dim; d++)
+                temp[d] += Nu_r*static_cast<acc_t>(Pw[d]);
+            }
+            const acc_t Nv_l = Nv[l];
+            for (int d = 0; d<dim; d++)
+              Sw[d] += Nv_l*temp[d];
           }
-          Sw += Nv_uv[j][l].item<float>()*temp[l];
+          const int64_t point = row*v_size + j;
+          for (int d = 0; d<_dimension; d++)
+            surface_ptr[point*_dimension + d] = Sw[d]/Sw[_dimension];
+          weight_ptr[point] = Sw[_dimension];
         }
-        surface[k][i][j] = Sw;
       }
-    }
-  }
-  return surface;
+    });
+  }));
+  return {surface, weight};
 }
 
+// Backward of surf_forward. grad_output is the gradient w.r.t. the divided
+// surfaces; the rational chain rule is applied per point from the saved
+// surfaces and weights, so the homogeneous gradient is never materialised:
+//   dL/dSw[d] = g[d]/w,  dL/dw = -sum_d g[d]*S[d]/w
 std::vector<torch::Tensor> surf_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor surfaces,
+    torch::Tensor weights,
     torch::Tensor uspan_uv,
     torch::Tensor vspan_uv,
     torch::Tensor Nu_uv,
@@ -168,33 +218,210 @@ std::vector<torch::Tensor> surf_backward(
     int p,
     int q,
     int _dimension) {
+  CHECK_CPU(grad_output); CHECK_CPU(ctrl_pts); CHECK_CPU(surfaces); CHECK_CPU(weights);
+  CHECK_CPU(Nu_uv); CHECK_CPU(Nv_uv);
+  CHECK_SPAN(uspan_uv); CHECK_SPAN(vspan_uv);
+  check_surf_inputs(ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv.size(0), v_uv.size(0), p, q, _dimension);
+  const std::vector<int64_t> out_sizes = {ctrl_pts.size(0), u_uv.size(0), v_uv.size(0), _dimension};
+  TORCH_CHECK(grad_output.sizes() == at::IntArrayRef(out_sizes), "grad_output must be ",
+      at::IntArrayRef(out_sizes), ", got ", grad_output.sizes());
+  TORCH_CHECK(surfaces.sizes() == grad_output.sizes() && weights.numel() == surfaces.numel()/_dimension,
+      "surfaces and weights must be the outputs of forward");
+
+  // Each output point only touches its (p+1)x(q+1) support, so scatter the
+  // gradient straight into a contiguous buffer instead of slicing tensors.
+  // Half and bfloat16 gradients are accumulated in float.
+  const auto dtype = grad_output.scalar_type();
+  grad_output = grad_output.contiguous();
+  surfaces = surfaces.to(dtype).contiguous();
+  weights = weights.to(dtype).contiguous();
+  uspan_uv = uspan_uv.contiguous();
+  vspan_uv = vspan_uv.contiguous();
+  Nu_uv = Nu_uv.to(dtype).contiguous();
+  Nv_uv = Nv_uv.to(dtype).contiguous();
+
+  const int batch_size = grad_output.size(0);
+  const int ctrl_u = ctrl_pts.size(1);
+  const int ctrl_v = ctrl_pts.size(2);
+  const int u_size = u_uv.size(0);
+  const int v_size = v_uv.size(0);
+  const int dim = _dimension + 1;
+
+  auto grad_ctrl_pts = torch::zeros({batch_size, ctrl_u, ctrl_v, dim}, grad_output.options().dtype(at::toOpMathType(dtype)));
+
+  const int64_t ctrl_row = (int64_t)ctrl_v*dim;
+  // Race-free parallelism by ownership: each task owns one control-point row
+  // a of one batch entry and gathers the contributions of the u-rows whose
+  // span support [uspan - p, uspan] contains a.
+  const int64_t row_cost = (int64_t)u_size*v_size*(q+1)*dim/std::max(1, ctrl_u);
+  const int64_t grain_size = std::max<int64_t>(1, at::internal::GRAIN_SIZE/std::max<int64_t>(1, row_cost));
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "surf_backward", ([&] {
+    using acc_t = at::opmath_type<scalar_t>;
+    const scalar_t* grad_ptr = grad_output.data_ptr<scalar_t>();
+    const scalar_t* surface_ptr = surfaces.data_ptr<scalar_t>();
+    const scalar_t* weight_ptr = weights.data_ptr<scalar_t>();
+    const int* uspan_ptr = uspan_uv.data_ptr<int>();
+    const int* vspan_ptr = vspan_uv.data_ptr<int>();
+    const scalar_t* Nu_ptr = Nu_uv.data_ptr<scalar_t>();
+    const scalar_t* Nv_ptr = Nv_uv.data_ptr<scalar_t>();
+    acc_t* grad_ctrl_ptr = grad_ctrl_pts.data_ptr<acc_t>();
+
+    at::parallel_for(0, (int64_t)batch_size*ctrl_u, grain_size, [&](int64_t begin, int64_t end) {
+      std::vector<acc_t> grad_sw(dim);
+      std::vector<acc_t> grad_temp(dim);
+      for (int64_t owned = begin; owned<end; owned++)
+      {
+        const int k = owned/ctrl_u;
+        const int a = owned%ctrl_u;
+        acc_t* G_a = grad_ctrl_ptr + owned*ctrl_row;
+        for (int i=0; i<u_size; i++)
+        {
+          const int r = a - (uspan_ptr[i] - p);
+          if (r < 0 || r > p)
+            continue;
+          const acc_t Nu_r = Nu_ptr[i*(p+1) + r];
+          for (int j=0; j<v_size; j++)
+          {
+            const int64_t point = ((int64_t)k*u_size + i)*v_size + j;
+            const scalar_t* g = grad_ptr + point*_dimension;
+            const scalar_t* S = surface_ptr + point*_dimension;
+            const acc_t w = weight_ptr[point];
+            grad_sw[_dimension] = 0;
+            for (int d = 0; d<_dimension; d++)
+            {
+              grad_sw[d] = static_cast<acc_t>(g[d])/w;
+              grad_sw[_dimension] -= grad_sw[d]*static_cast<acc_t>(S[d]);
+            }
+
+            const scalar_t* Nv = Nv_ptr + j*(q+1);
+            acc_t* G = G_a + (vspan_ptr[j] - q)*dim;
+            for (int l = 0; l<=q; l++)
+            {
+              const acc_t Nv_l = Nv[l];
+              for (int d = 0; d<dim; d++)
+                grad_temp[d] = Nv_l*grad_sw[d];
+              for (int d = 0; d<dim; d++)
+                G[l*dim + d] += Nu_r*grad_temp[d];
+            }
+          }
+        }
+      }
+    });
+  }));
+  return {grad_ctrl_pts.to(dtype)};
+}
+
+
+
+// Basis functions of a batch of knot vectors, used when the knots are
+// learned. u: (N), U: (B, K), uspan: (B, N). Returns N: (B, p+1, N).
+torch::Tensor basis_forward(
+    torch::Tensor u,
+    torch::Tensor U,
+    torch::Tensor uspan,
+    int p,
+    double eps) {
+
+  TORCH_CHECK(p <= pmax, "basis_forward supports degrees up to ", pmax);
+  CHECK_CPU(u); CHECK_CPU(U); CHECK_CPU(uspan);
+  // Half and bfloat16 knots are evaluated in float
+  const auto dtype = U.scalar_type();
+  const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+  u = u.reshape({-1}).to(compute_dtype).contiguous();
+  U = U.to(compute_dtype).contiguous();
+  uspan = uspan.to(torch::kLong).contiguous();
+
+  const int batch_size = U.size(0);
+  const int knots = U.size(1);
+  const int u_size = u.size(0);
+
+  auto Nu = torch::empty({batch_size, p+1, u_size}, U.options());
+
+  AT_DISPATCH_FLOATING_TYPES(compute_dtype, "basis_forward", ([&] {
+    const scalar_t* u_ptr = u.data_ptr<scalar_t>();
+    const scalar_t* U_ptr = U.data_ptr<scalar_t>();
+    const int64_t* uspan_ptr = uspan.data_ptr<int64_t>();
+    scalar_t* Nu_ptr = Nu.data_ptr<scalar_t>();
+
+    at::parallel_for(0, (int64_t)batch_size*u_size, 1024, [&](int64_t begin, int64_t end) {
+      scalar_t N[pmax+1];
+      for (int64_t idx = begin; idx<end; idx++)
+      {
+        const int s = idx/u_size;
+        const int i = idx%u_size;
+        basis_funs_knot_ders<scalar_t>(uspan_ptr[idx], u_ptr[i], p, U_ptr + (int64_t)s*knots, eps, N, NULL);
+        for (int r = 0; r<=p; r++)
+          Nu_ptr[((int64_t)s*(p+1) + r)*u_size + i] = N[r];
+      }
+    });
+  }));
+  return Nu.to(dtype);
+}
+
+// Gradient of the basis functions w.r.t. the knot vectors: every parameter
+// contributes to the 2p knots around its span. Each task owns one knot
+// vector, so the accumulation is race-free. Returns {grad_U: (B, K)}.
+std::vector<torch::Tensor> basis_backward(
+    torch::Tensor grad_output,
+    torch::Tensor u,
+    torch::Tensor U,
+    torch::Tensor uspan,
+    int p,
+    double eps) {
+
+  TORCH_CHECK(p <= pmax, "basis_backward supports degrees up to ", pmax);
+  CHECK_CPU(grad_output); CHECK_CPU(u); CHECK_CPU(U); CHECK_CPU(uspan);
+  const auto dtype = U.scalar_type();
+  const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+  grad_output = grad_output.to(compute_dtype).contiguous();
+  u = u.reshape({-1}).to(compute_dtype).contiguous();
+  U = U.to(compute_dtype).contiguous();
+  uspan = uspan.to(torch::kLong).contiguous();
+
+  const int batch_size = U.size(0);
+  const int knots = U.size(1);
+  const int u_size = u.size(0);
+  const int w = 2*p;
+
+  auto grad_U = torch::zeros_like(U);
 
-  auto grad_ctrl_pts = torch::zeros_like(ctrl_pts);
+  AT_DISPATCH_FLOATING_TYPES(compute_dtype, "basis_backward", ([&] {
+    const scalar_t* grad_ptr = grad_output.data_ptr<scalar_t>();
+    const scalar_t* u_ptr = u.data_ptr<scalar_t>();
+    const scalar_t* U_ptr = U.data_ptr<scalar_t>();
+    const int64_t* uspan_ptr = uspan.data_ptr<int64_t>();
+    scalar_t* grad_U_ptr = grad_U.data_ptr<scalar_t>();
 
-  for (int k=0; k<grad_output.size(0); k++)
-  {
-    for (int j=0; j<v_uv.size(0); j++)
-    {
-      for (int i=0; i<u_uv.size(0); i++)
+    at::parallel_for(0, batch_size, 1, [&](int64_t begin, int64_t end) {
+      scalar_t N[pmax+1];
+      scalar_t dN[(pmax+1)*2*pmax];
+      for (int64_t s = begin; s<end; s++)
       {
-        auto grad_temp = torch::zeros({q+1,_dimension+1});
-        for (int l = 0; l<=q; l++)
+        const scalar_t* U_s = U_ptr + s*knots;
+        scalar_t* grad_U_s = grad_U_ptr + s*knots;
+        for (int i = 0; i<u_size; i++)
         {
-          grad_temp[l] = Nv_uv[j][l]*grad_output[k][i][j];
+          const int span = uspan_ptr[s*u_size + i];
+          basis_funs_knot_ders<scalar_t>(span, u_ptr[i], p, U_s, eps, N, dN);
           for (int r = 0; r<=p; r++)
           {
-            grad_ctrl_pts[k][uspan_uv[i].item<int>() - p + r][vspan_uv[j].item<int>() - q + l] = grad_ctrl_pts[k][uspan_uv[i].item<int>() - p + r][vspan_uv[j].item<int>() - q + l] + Nu_uv[i][r].item<float>()*grad_temp[l];
+            const scalar_t g = grad_ptr[(s*(p+1) + r)*u_size + i];
+            for (int t = 0; t<w; t++)
+              grad_U_s[span+1-p+t] += g*dN[r*w + t];
           }
         }
       }
-    }
-  }
-  return {grad_ctrl_pts};
+    });
+  }));
+  return {grad_U.to(dtype)};
 }
 
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
   m.def("pre_compute_basis", &surf_pre_compute_basis, "Pre-Compute Basis");
-  m.def("forward", &surf_forward, "forward func for curve eval");
-  m.def("backward", &surf_backward, "forward func for curve eval");
+  m.def("forward", &surf_forward, "forward func for surf eval");
+  m.def("backward", &surf_backward, "backward func for surf eval");
+  m.def("basis_forward", &basis_forward, "basis functions of a batch of knot vectors");
+  m.def("basis_backward", &basis_backward, "knot vector gradient of the basis functions");
 }
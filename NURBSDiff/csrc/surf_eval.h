@@ -13,7 +13,7 @@ std::vector<at::Tensor> surf_pre_compute_basis(at::Tensor u,
     int out_dim,
     int _dimension);
 
-at::Tensor surf_forward(
+std::vector<at::Tensor> surf_forward(
     at::Tensor ctrl_pts,
     at::Tensor uspan_uv,
     at::Tensor vspan_uv,
@@ -30,6 +30,8 @@ at::Tensor surf_forward(
 std::vector<at::Tensor> surf_backward(
     at::Tensor grad_output,
     at::Tensor ctrl_pts,
+    at::Tensor surfaces,
+    at::Tensor weights,
     at::Tensor uspan_uv,
     at::Tensor vspan_uv,
     at::Tensor Nu_uv,
@@ -40,4 +42,19 @@ std::vector<at::Tensor> surf_backward(
     int n,
     int p,
     int q,
-    int _dimension);
\ No newline at end of file
+    int _dimension);
+
+at::Tensor basis_forward(
+    at::Tensor u,
+    at::Tensor U,
+    at::Tensor uspan,
+    int p,
+    double eps);
+
+std::vector<at::Tensor> basis_backward(
+    at::Tensor grad_output,
+    at::Tensor u,
+    at::Tensor U,
+    at::Tensor uspan,
+    int p,
+    double eps);
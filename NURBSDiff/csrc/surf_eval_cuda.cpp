@@ -19,10 +19,12 @@ std::vector<torch::Tensor> surf_cuda_pre_compute_basis(torch::Tensor u,
 
 std::vector<torch::Tensor> surf_cuda_forward(
     torch::Tensor ctrl_pts,
+    torch::Tensor uspan_uv,
+    torch::Tensor vspan_uv,
+    torch::Tensor Nu_uv,
+    torch::Tensor Nv_uv,
     torch::Tensor u_uv,
     torch::Tensor v_uv,
-    torch::Tensor U,
-    torch::Tensor V,
     int m,
     int n,
     int p,
@@ -33,6 +35,8 @@ std::vector<torch::Tensor> surf_cuda_forward(
 std::vector<torch::Tensor> surf_cuda_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor surfaces,
+    torch::Tensor weights,
     torch::Tensor uspan_uv,
     torch::Tensor vspan_uv,
     torch::Tensor Nu_uv,
@@ -72,58 +76,38 @@ return surf_cuda_pre_compute_basis(u,v,U,V,m,n,p,q,out_dim,_dimension);
 }
 
 
+// Returns {surfaces: (B, U, V, d), weights: (B, U, V)}
 std::vector<torch::Tensor> surf_forward(
     torch::Tensor ctrl_pts,
+    torch::Tensor uspan_uv,
+    torch::Tensor vspan_uv,
+    torch::Tensor Nu_uv,
+    torch::Tensor Nv_uv,
     torch::Tensor u_uv,
     torch::Tensor v_uv,
-    torch::Tensor U,
-    torch::Tensor V,
     int m,
     int n,
     int p,
     int q,
-    int _dimension
-)
+    int _dimension)
 
-{   
-    CHECK_INPUT(u_uv);
-    CHECK_INPUT(v_uv);
-    CHECK_INPUT(U);
-    CHECK_INPUT(V);
-    std::cout<<"precompute cpp";
+{
+    CHECK_INPUT(ctrl_pts);
+    CHECK_INPUT(uspan_uv);
+    CHECK_INPUT(vspan_uv);
+    CHECK_INPUT(Nu_uv);
+    CHECK_INPUT(Nv_uv);
 
-return surf_cuda_forward(ctrl_pts,u_uv,v_uv,U,V,m,n,p,q,_dimension);
+return surf_cuda_forward(ctrl_pts,uspan_uv,vspan_uv,Nu_uv,Nv_uv,u_uv,v_uv,m,n,p,q,_dimension);
 
 }
 
 
-// std::vector<torch::Tensor>surf_forward(
-//     torch::Tensor ctrl_pts,
-//     torch::Tensor u_uv,
-//     torch::Tensor v_uv,
-//     torch::Tensor U,
-//     torch::Tensor V,
-//     int m,
-//     int n,
-//     int p,
-//     int q,
-//     int _dimension)
-//     {
-
-//     std::cout<<"surf_forward";
-//     CHECK_INPUT(ctrl_pts);
-//     CHECK_INPUT(u_uv);
-//     CHECK_INPUT(v_uv);
-//     CHECK_INPUT(U);
-//     CHECK_INPUT(V);
-
-//     return surf_cuda_forward(ctrl_pts,u_uv,v_uv,U,V,m,n,p,q,_dimension);
-
-//     }
-
 std::vector<torch::Tensor>surf_backward(
     torch::Tensor grad_output,
     torch::Tensor ctrl_pts,
+    torch::Tensor surfaces,
+    torch::Tensor weights,
     torch::Tensor uspan_uv,
     torch::Tensor vspan_uv,
     torch::Tensor Nu_uv,
@@ -136,24 +120,23 @@ std::vector<torch::Tensor>surf_backward(
     int q,
     int _dimension)
     {
-        
+
+    grad_output = grad_output.contiguous();
     CHECK_INPUT(grad_output);
-    CHECK_INPUT(ctrl_pts);
+    CHECK_INPUT(surfaces);
+    CHECK_INPUT(weights);
     CHECK_INPUT(uspan_uv);
     CHECK_INPUT(vspan_uv);
     CHECK_INPUT(Nu_uv);
     CHECK_INPUT(Nv_uv);
-    CHECK_INPUT(u_uv);
-    CHECK_INPUT(v_uv);
 
 
-    return surf_cuda_backward(grad_output,ctrl_pts,uspan_uv,vspan_uv,Nu_uv,Nv_uv,u_uv,v_uv,m,n,p,q,_dimension);
+    return surf_cuda_backward(grad_output,ctrl_pts,surfaces,weights,uspan_uv,vspan_uv,Nu_uv,Nv_uv,u_uv,v_uv,m,n,p,q,_dimension);
 
     }
 
 
 
-    
     PYBIND11_MODULE(TORCH_EXTENSION_NAME,m)
     {
     m.def("pre_compute_basis", &surf_pre_compute_basis, "Pre-Compute Basis");
@@ -3,6 +3,8 @@
 
 #include <cuda.h>
 #include <cuda_runtime.h>
+#include <ATen/OpMathType.h>
+#include <ATen/cuda/Atomic.cuh>
 
 
 #include <vector>
@@ -10,7 +12,8 @@
 
 namespace {
 
-__device__ __forceinline__ int find_span(int n, int p, float u, float* U)
+template <typename scalar_t>
+__device__ __forceinline__ int find_span(int n, int p, scalar_t u, scalar_t* U)
 
 {
 
@@ -33,12 +36,13 @@ return mid;
 
 
 
-__device__ __forceinline__ void basis_funs(int uspan_i, float u, int p, float* U, float* N, unsigned int i)
+template <typename scalar_t>
+__device__ __forceinline__ void basis_funs(int uspan_i, scalar_t u, int p, scalar_t* U, scalar_t* N, unsigned int i)
 { 
 
-  float *left  = new float [p+1];
-  float *right = new float [p+1];
-  float saved, temp;
+  scalar_t *left  = new scalar_t [p+1];
+  scalar_t *right = new scalar_t [p+1];
+  scalar_t saved, temp;
   int col = p + 1;
   N[i*col] = 1.0;
   for (int j=1; j<=p; j++){
@@ -56,22 +60,25 @@ __device__ __forceinline__ void basis_funs(int uspan_i, float u, int p, float* U
     }
     N[i*col+j] = saved;
   }
+  delete [] left;
+  delete [] right;
 
 }
 
 
 
 
+template <typename scalar_t>
 __global__ void surf_cuda_pre_compute_basis_kernel(
     torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
     torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> vspan,
-    // torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-    torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-    torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> v,
-    float* U_ptr,
-    float* V_ptr,
-    float* Nu_ptr,
-    float* Nv_ptr,
+    // torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nu,
+    torch::PackedTensorAccessor<scalar_t,1,torch::RestrictPtrTraits,size_t> u,
+    torch::PackedTensorAccessor<scalar_t,1,torch::RestrictPtrTraits,size_t> v,
+    scalar_t* U_ptr,
+    scalar_t* V_ptr,
+    scalar_t* Nu_ptr,
+    scalar_t* Nv_ptr,
     int m, 
     int n,
     int p, 
@@ -104,24 +111,17 @@ __global__ void surf_cuda_pre_compute_basis_kernel(
   }
 
 
+// One thread per output point (k, i, j). The weight channel is accumulated
+// first so every coordinate is divided as soon as it has been summed.
+template <typename scalar_t>
 __global__ void surf_cuda_forward_kernel(
-  torch::PackedTensorAccessor<float,4,torch::RestrictPtrTraits,size_t> ctrl_pts,
+  torch::PackedTensorAccessor<scalar_t,4,torch::RestrictPtrTraits,size_t> ctrl_pts,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> vspan,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nv,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> v,
-  torch::PackedTensorAccessor<float,4,torch::RestrictPtrTraits,size_t> surfaces,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> temp,
-  // int* uspan,
-  // float* Nu,
-  float* U_ptr,
-  float* V_ptr,
-  float* Nu_ptr,
-  float* Nv_ptr,
-  int m,
-  int n,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nu,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nv,
+  torch::PackedTensorAccessor<scalar_t,4,torch::RestrictPtrTraits,size_t> surfaces,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> weights,
   int p,
   int q,
   int _dimension,
@@ -129,73 +129,47 @@ __global__ void surf_cuda_forward_kernel(
   unsigned int u_size,
   unsigned int v_size){
 
+  using acc_t = at::opmath_type<scalar_t>;
   unsigned int k = blockIdx.z;
   unsigned int i = blockIdx.x * blockDim.x + threadIdx.x;
   unsigned int j = blockIdx.y * blockDim.y + threadIdx.y;
-  // std::printf("Hello from k %d, i %d, l %d\n", k,i,l);
-
-  // std:: printf("This is block idx %d, block dimx %d, thread idx %d\n" ,blockIdx.x, blockDim.x, threadIdx.x);
-
-  // std:: printf("This is k %d, i %d, j %d\n" , k , i,j);
-
-  if (i < u_size)
-  {uspan[i]= find_span(m, p, u[i], U_ptr);
-  basis_funs(uspan[i],u[i],p,U_ptr,Nu_ptr,i);}
-
-  if (j<v_size)
-  {vspan[j] = find_span(n, q, v[j], V_ptr);
-    basis_funs(vspan[j],v[j],q,V_ptr,Nv_ptr,j);}
-  if(k < batch_size)
-  { 
-    if (j < v_size )
-    { 
-    
-      if (i < u_size )
-      { 
-        
-        for (int d=0; d<=_dimension; d++)
-          {
-            for (int l = 0; l<=q; l++)
-            {
-              temp[l][d]=0;
-              for (int r = 0; r <=p ; r++)
-              { 
-                
-              temp[l][d] = temp[l][d] + Nu[i][r]*ctrl_pts[k][uspan[i]-p+r][vspan[j]-q+l][d];
-              
-              }
-            
-            
-            surfaces[k][i][j][d] = surfaces[k][i][j][d] + Nv[j][l]*temp[l][d];
-
-            }
-
-          
-
-          }
-  
-      }
 
+  if (k < batch_size && i < u_size && j < v_size)
+  {
+    const int row = uspan[i] - p;
+    const int col = vspan[j] - q;
+
+    acc_t w = 0.0;
+    for (int l = 0; l<=q; l++)
+      for (int r = 0; r<=p; r++)
+        w += static_cast<acc_t>(Nu[i][r])*static_cast<acc_t>(Nv[j][l])*static_cast<acc_t>(ctrl_pts[k][row+r][col+l][_dimension]);
+
+    for (int d = 0; d<_dimension; d++)
+    {
+      acc_t Sw = 0.0;
+      for (int l = 0; l<=q; l++)
+        for (int r = 0; r<=p; r++)
+          Sw += static_cast<acc_t>(Nu[i][r])*static_cast<acc_t>(Nv[j][l])*static_cast<acc_t>(ctrl_pts[k][row+r][col+l][d]);
+      surfaces[k][i][j][d] = Sw/w;
     }
+    weights[k][i][j] = w;
   }
- 
 }
-   
+
+// One thread per output point: applies the rational chain rule locally and
+// scatters into the (p+1)x(q+1) supporting control points. Neighbouring
+// points share control points, hence the atomics, which always act on the
+// float or double accumulation buffer.
+template <typename scalar_t>
 __global__ void surf_cuda_backward_kernel(
-  torch::PackedTensorAccessor<float,4,torch::RestrictPtrTraits,size_t> grad_output,
-  torch::PackedTensorAccessor<float,4,torch::RestrictPtrTraits,size_t> ctrl_pts,
+  torch::PackedTensorAccessor<scalar_t,4,torch::RestrictPtrTraits,size_t> grad_output,
+  torch::PackedTensorAccessor<scalar_t,4,torch::RestrictPtrTraits,size_t> surfaces,
+  torch::PackedTensorAccessor<scalar_t,3,torch::RestrictPtrTraits,size_t> weights,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> uspan,
   torch::PackedTensorAccessor<int,1,torch::RestrictPtrTraits,size_t> vspan,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nu,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> Nv,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> u,
-  torch::PackedTensorAccessor<float,1,torch::RestrictPtrTraits,size_t> v,
-  torch::PackedTensorAccessor<float,4,torch::RestrictPtrTraits,size_t> grad_ctrl_pts,
-  torch::PackedTensorAccessor<float,2,torch::RestrictPtrTraits,size_t> grad_temp,
-  // int* uspan,
-  // float* Nu,
-  int m,
-  int n,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nu,
+  torch::PackedTensorAccessor<scalar_t,2,torch::RestrictPtrTraits,size_t> Nv,
+  torch::PackedTensorAccessor<at::opmath_type<scalar_t>,4,torch::RestrictPtrTraits,size_t> grad_ctrl_pts,
   int p,
   int q,
   int _dimension,
@@ -203,45 +177,34 @@ __global__ void surf_cuda_backward_kernel(
   unsigned int u_size,
   unsigned int v_size){
 
+  using acc_t = at::opmath_type<scalar_t>;
   unsigned int k = blockIdx.z;
   unsigned int i = blockIdx.x * blockDim.x + threadIdx.x;
   unsigned int j = blockIdx.y * blockDim.y + threadIdx.y;
-  // std::printf("Hello from k %d, i %d, l %d\n", k,i,l);
-
 
-  if(k < batch_size )
-  { if ( j< v_size )
-    { if( i < u_size )
-      { 
-
-        for (int d=0; d<=_dimension; d++)
-          { 
-            
-            for (int l = 0; l<=q; l++)
-            {   
-              
-              grad_temp[l][d] = Nv[j][l]*grad_output[k][i][j][d];
-
-
-              for (int r = 0; r <=p ; r++)
-              { 
-                grad_ctrl_pts[k][ uspan[i] - p + r][ vspan[j] - q + l ][d] = grad_ctrl_pts[k][ uspan[i] - p + r][ vspan[j] - q + l ][d] + Nu[i][r]*grad_temp[l][d];
-              
-              }
-
-            }
-          }
-  
+  if (k < batch_size && i < u_size && j < v_size)
+  {
+    const int row = uspan[i] - p;
+    const int col = vspan[j] - q;
+    const acc_t w = weights[k][i][j];
+
+    acc_t grad_w = 0.0;
+    for (int d = 0; d<_dimension; d++)
+      grad_w -= static_cast<acc_t>(grad_output[k][i][j][d])*static_cast<acc_t>(surfaces[k][i][j][d]);
+    grad_w /= w;
+
+    for (int l = 0; l<=q; l++)
+    {
+      for (int r = 0; r<=p; r++)
+      {
+        const acc_t N = static_cast<acc_t>(Nu[i][r])*static_cast<acc_t>(Nv[j][l]);
+        for (int d = 0; d<_dimension; d++)
+          gpuAtomicAdd(&grad_ctrl_pts[k][row+r][col+l][d], N*static_cast<acc_t>(grad_output[k][i][j][d])/w);
+        gpuAtomicAdd(&grad_ctrl_pts[k][row+r][col+l][_dimension], N*grad_w);
       }
-
     }
   }
- 
 }
-   
-
-
-
 
 } //namespace end
 
@@ -258,171 +221,147 @@ std::vector<torch::Tensor> surf_cuda_pre_compute_basis(
     int q,
     int out_dim,
     int _dimension){
-  
-    float* U_ptr = (float*)U.data_ptr();
-    float* V_ptr = (float*)V.data_ptr();
-    auto options1 = torch::TensorOptions().dtype(torch::kInt32).device(torch::kCUDA, 0).requires_grad(false);
-    auto options2 = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-    
-    // auto device = torch::device(torch::kCUDA, 1);
+
+    // Half and bfloat16 parameters are evaluated in float and the bases cast back
+    const auto dtype = u.scalar_type();
+    const auto compute_dtype = at::isReducedFloatingType(dtype) ? at::kFloat : dtype;
+    u = u.to(compute_dtype).contiguous();
+    v = v.to(compute_dtype).contiguous();
+    U = U.to(compute_dtype).contiguous();
+    V = V.to(compute_dtype).contiguous();
+
+    auto options1 = torch::TensorOptions().dtype(torch::kInt32).device(u.device()).requires_grad(false);
+
     auto uspan = torch::zeros(u.size(0), options1);
     auto vspan = torch::zeros(v.size(0), options1);
-    auto Nu = torch::zeros({(u.size(0))*( p + 1)}, options2);
-    auto Nv = torch::zeros({(v.size(0))*(q + 1)}, options2);
-    float* Nu_ptr = (float*)Nu.data_ptr();
-    float* Nv_ptr = (float*)Nv.data_ptr();
-  
+    auto Nu = torch::zeros({(u.size(0))*( p + 1)}, u.options());
+    auto Nv = torch::zeros({(v.size(0))*(q + 1)}, u.options());
+
     int u_size = u.size(0);
     int v_size = v.size(0);
-  
+
     const dim3 block(32, 32, 1);
     const dim3 grid(u_size/32+1, v_size/32+1, 1);
-  
-    // AT_DISPATCH_FLOATING_TYPES(u.type(), "curve_cuda_pre_compute", ([&] {
-      surf_cuda_pre_compute_basis_kernel<<<grid, block>>>(
+
+    AT_DISPATCH_FLOATING_TYPES(compute_dtype, "surf_cuda_pre_compute_basis", ([&] {
+      surf_cuda_pre_compute_basis_kernel<scalar_t><<<grid, block>>>(
           uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
           vspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-          // Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-          u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-          v.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-          U_ptr,
-          V_ptr,
-          Nu_ptr,
-          Nv_ptr,
-          m, 
-          n, 
-          p, 
-          q, 
-          out_dim, 
+          u.packed_accessor<scalar_t,1,torch::RestrictPtrTraits,size_t>(),
+          v.packed_accessor<scalar_t,1,torch::RestrictPtrTraits,size_t>(),
+          U.data_ptr<scalar_t>(),
+          V.data_ptr<scalar_t>(),
+          Nu.data_ptr<scalar_t>(),
+          Nv.data_ptr<scalar_t>(),
+          m,
+          n,
+          p,
+          q,
+          out_dim,
           _dimension,
           u_size,
           v_size);
-    // }));
+    }));
+
+      return {uspan, vspan, Nu.to(dtype), Nv.to(dtype)};
 
- 
-      return {uspan, vspan, Nu, Nv};
-    
     }
 
-std::vector<torch::Tensor>surf_cuda_forward(
+std::vector<torch::Tensor> surf_cuda_forward(
     torch::Tensor ctrl_pts,
+    torch::Tensor uspan,
+    torch::Tensor vspan,
+    torch::Tensor Nu,
+    torch::Tensor Nv,
     torch::Tensor u,
     torch::Tensor v,
-    torch::Tensor U,
-    torch::Tensor V,
     int m,
     int n,
     int p,
     int q,
     int _dimension){
-    auto options = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-  
-    // float* Nu_ptr = (float*)Nu.data_ptr();
-    // int* uspan_ptr = (int*)uspan.data_ptr();
-    auto surfaces = torch::zeros({ctrl_pts.size(0),u.size(0), v.size(0), _dimension+1}, options);
-    auto temp = torch::zeros({q+1, _dimension+1},options);
-    unsigned int batch_size = ctrl_pts.size(0);
-    unsigned int u_size = u.size(0);
-    unsigned int v_size = v.size(0);
-  
-    const dim3 block(16, 16, 1);
-    const dim3 grid((u_size)/16+1, (v_size)/16+1, batch_size);
-  
-
-    float* U_ptr = (float*)U.data_ptr();
-    float* V_ptr = (float*)V.data_ptr();
-    auto options1 = torch::TensorOptions().dtype(torch::kInt32).device(torch::kCUDA, 0).requires_grad(false);
-    auto options2 = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-
-    // auto device = torch::device(torch::kCUDA, 1);
-    auto uspan = torch::zeros(u.size(0), options1);
-    auto vspan = torch::zeros(v.size(0), options1);
-    auto Nu = torch::zeros({(u.size(0)),( p + 1)}, options2);
-    auto Nv = torch::zeros({(v.size(0)),(q + 1)}, options2);
-    float* Nu_ptr = (float*)Nu.data_ptr();
-    float* Nv_ptr = (float*)Nv.data_ptr();
-
 
-    surf_cuda_forward_kernel<<<grid, block>>>(
-      ctrl_pts.packed_accessor<float,4,torch::RestrictPtrTraits,size_t>(),
+  const auto dtype = ctrl_pts.scalar_type();
+  Nu = Nu.to(dtype);
+  Nv = Nv.to(dtype);
+  unsigned int batch_size = ctrl_pts.size(0);
+  unsigned int u_size = u.size(0);
+  unsigned int v_size = v.size(0);
+  auto surfaces = torch::empty({batch_size, u_size, v_size, _dimension}, ctrl_pts.options());
+  auto weights = torch::empty({batch_size, u_size, v_size}, ctrl_pts.options());
+
+  const dim3 block(16, 16, 1);
+  const dim3 grid((u_size)/16+1, (v_size)/16+1, batch_size);
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "surf_cuda_forward", ([&] {
+    surf_cuda_forward_kernel<scalar_t><<<grid, block>>>(
+      ctrl_pts.packed_accessor<scalar_t,4,torch::RestrictPtrTraits,size_t>(),
       uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
       vspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-      Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-      Nv.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-      u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-      v.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-      surfaces.packed_accessor<float,4,torch::RestrictPtrTraits,size_t>(),
-      temp.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-      U_ptr,
-      V_ptr,
-      Nu_ptr,
-      Nv_ptr,
-      m, 
-      n,  
+      Nu.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      Nv.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      surfaces.packed_accessor<scalar_t,4,torch::RestrictPtrTraits,size_t>(),
+      weights.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
       p,
       q,
       _dimension,
       batch_size,
       u_size,
       v_size);
-  
-  
-      return {surfaces,Nu,Nv,uspan,vspan};
-  
-    }
+  }));
 
+  return {surfaces, weights};
+}
 
 
-    std::vector<torch::Tensor>surf_cuda_backward(
-      torch::Tensor grad_output,
-      torch::Tensor ctrl_pts,
-      torch::Tensor uspan,
-      torch::Tensor vspan,
-      torch::Tensor Nu,
-      torch::Tensor Nv,
-      torch::Tensor u,
-      torch::Tensor v,
-      int m,
-      int n,
-      int p,
-      int q,
-      int _dimension){
-      
-      auto options = torch::TensorOptions().dtype(torch::kFloat32).device(torch::kCUDA, 0).requires_grad(true);
-    
-      // float* Nu_ptr = (float*)Nu.data_ptr();
-      // int* uspan_ptr = (int*)uspan.data_ptr();
-      auto grad_ctrl_pts = torch::zeros({ctrl_pts.size(0),ctrl_pts.size(1), ctrl_pts.size(2), _dimension+1}, options);
-      auto grad_temp = torch::zeros({q+1, _dimension+1},options);
-      unsigned int batch_size = grad_output.size(0);
-      unsigned int u_size = u.size(0);
-      unsigned int v_size = v.size(0);
-    
-      const dim3 block(16, 16, 1);
-      const dim3 grid((u_size)/16+1, (v_size)/16+1, batch_size);
-    
-    
-      surf_cuda_backward_kernel<<<grid, block>>>(
-        grad_output.packed_accessor<float,4,torch::RestrictPtrTraits,size_t>(),
-        ctrl_pts.packed_accessor<float,4,torch::RestrictPtrTraits,size_t>(),
-        uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-        vspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
-        Nu.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-        Nv.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-        u.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-        v.packed_accessor<float,1,torch::RestrictPtrTraits,size_t>(),
-        grad_ctrl_pts.packed_accessor<float,4,torch::RestrictPtrTraits,size_t>(),
-        grad_temp.packed_accessor<float,2,torch::RestrictPtrTraits,size_t>(),
-        m, 
-        n,
-        p,
-        q,  
-        _dimension,
-        batch_size,
-        u_size,
-        v_size);
-    
-    
-        return {grad_ctrl_pts};
-    
-      }
\ No newline at end of file
+std::vector<torch::Tensor> surf_cuda_backward(
+    torch::Tensor grad_output,
+    torch::Tensor ctrl_pts,
+    torch::Tensor surfaces,
+    torch::Tensor weights,
+    torch::Tensor uspan,
+    torch::Tensor vspan,
+    torch::Tensor Nu,
+    torch::Tensor Nv,
+    torch::Tensor u,
+    torch::Tensor v,
+    int m,
+    int n,
+    int p,
+    int q,
+    int _dimension){
+
+  const auto dtype = grad_output.scalar_type();
+  surfaces = surfaces.to(dtype);
+  weights = weights.to(dtype);
+  Nu = Nu.to(dtype);
+  Nv = Nv.to(dtype);
+  // Half and bfloat16 gradients are accumulated in float
+  auto grad_ctrl_pts = torch::zeros({ctrl_pts.size(0), ctrl_pts.size(1), ctrl_pts.size(2), _dimension+1}, grad_output.options().dtype(at::toOpMathType(dtype)));
+  unsigned int batch_size = grad_output.size(0);
+  unsigned int u_size = u.size(0);
+  unsigned int v_size = v.size(0);
+
+  const dim3 block(16, 16, 1);
+  const dim3 grid((u_size)/16+1, (v_size)/16+1, batch_size);
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(at::kHalf, at::kBFloat16, dtype, "surf_cuda_backward", ([&] {
+    surf_cuda_backward_kernel<scalar_t><<<grid, block>>>(
+      grad_output.packed_accessor<scalar_t,4,torch::RestrictPtrTraits,size_t>(),
+      surfaces.packed_accessor<scalar_t,4,torch::RestrictPtrTraits,size_t>(),
+      weights.packed_accessor<scalar_t,3,torch::RestrictPtrTraits,size_t>(),
+      uspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
+      vspan.packed_accessor<int,1,torch::RestrictPtrTraits,size_t>(),
+      Nu.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      Nv.packed_accessor<scalar_t,2,torch::RestrictPtrTraits,size_t>(),
+      grad_ctrl_pts.packed_accessor<at::opmath_type<scalar_t>,4,torch::RestrictPtrTraits,size_t>(),
+      p,
+      q,
+      _dimension,
+      batch_size,
+      u_size,
+      v_size);
+  }));
+
+  return {grad_ctrl_pts.to(dtype)};
+}
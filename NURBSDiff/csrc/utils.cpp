@@ -3,11 +3,13 @@
 #include <stdlib.h>
 #include <math.h>
 
+#include "utils.h"
+
 #define eps 1.0e-4
-#define pmax 10
 
 // Algorithm A2.1 (page 68)
-int find_span(int n, int p, float u, float* U)
+template <typename scalar_t>
+int find_span(int n, int p, scalar_t u, scalar_t* U)
 {
       //if (u == U[n+1])
       //      return n; // Special case
@@ -29,11 +31,12 @@ int find_span(int n, int p, float u, float* U)
 
 
 // Algorithm A2.2 (page 70)
-void basis_funs(int i, float u, int p, float* U, float* N)
+template <typename scalar_t>
+void basis_funs(int i, scalar_t u, int p, scalar_t* U, scalar_t* N)
 {
-      float *left  = new float [p+1];
-      float *right = new float [p+1];
-      float saved, temp;
+      scalar_t left[pmax+1];
+      scalar_t right[pmax+1];
+      scalar_t saved, temp;
       N[0] = 1.0;
       for (int j = 1; j <= p; j += 1){
             left[j] = u-U[i+1-j];
@@ -46,7 +49,88 @@ void basis_funs(int i, float u, int p, float* U, float* N)
             }
             N[j] = saved;
       }
-      
-      delete[] left;
-      delete[] right;
 }
+
+
+// Spans and non-zero basis functions for a whole array of parameters,
+// written to span[size] and N[size*(p+1)]
+template <typename scalar_t>
+void basis_funs_batch(int n, int p, const scalar_t* u, int size, scalar_t* U, int* span, scalar_t* N)
+{
+      for (int i = 0; i < size; i += 1){
+            span[i] = find_span(n, p, u[i], U);
+            basis_funs(span[i], u[i], p, U, N + i*(p+1));
+      }
+}
+
+
+// Algorithm A2.2 with a guard for vanishing denominators (the term is set to
+// tol) and, when dN is not NULL, forward-mode derivatives of every basis
+// function with respect to the 2p knots U[i+1-p] ... U[i+p] it depends on.
+// dN is laid out as dN[r*2p + t] = dN_r/dU[i+1-p+t].
+template <typename scalar_t>
+void basis_funs_knot_ders(int i, scalar_t u, int p, const scalar_t* U, scalar_t tol, scalar_t* N, scalar_t* dN)
+{
+      const int w = 2*p;
+      const int base = i+1-p;
+      scalar_t dsaved[2*pmax];
+      scalar_t dtemp[2*pmax];
+      scalar_t saved, temp, den, left, right;
+      N[0] = 1.0;
+      if (dN != NULL)
+            for (int t = 0; t < (p+1)*w; t += 1)
+                  dN[t] = 0.0;
+      for (int j = 1; j <= p; j += 1){
+            saved = 0.0;
+            if (dN != NULL)
+                  for (int t = 0; t < w; t += 1)
+                        dsaved[t] = 0.0;
+            for (int r = 0; r < j; r += 1){
+                  // right = U[a]-u, left = u-U[b], den = right+left
+                  const int a = i+r+1;
+                  const int b = i+1-j+r;
+                  right = U[a]-u;
+                  left = u-U[b];
+                  den = right + left;
+                  if (den == 0.0){
+                        temp = tol;
+                        if (dN != NULL)
+                              for (int t = 0; t < w; t += 1)
+                                    dtemp[t] = 0.0;
+                  }
+                  else{
+                        temp = N[r]/den;
+                        if (dN != NULL){
+                              for (int t = 0; t < w; t += 1)
+                                    dtemp[t] = dN[r*w+t]/den;
+                              dtemp[a-base] -= temp/den;
+                              dtemp[b-base] += temp/den;
+                        }
+                  }
+                  N[r] = saved + right*temp;
+                  if (dN != NULL){
+                        for (int t = 0; t < w; t += 1)
+                              dN[r*w+t] = dsaved[t] + right*dtemp[t];
+                        dN[r*w+a-base] += temp;
+                        for (int t = 0; t < w; t += 1)
+                              dsaved[t] = left*dtemp[t];
+                        dsaved[b-base] -= temp;
+                  }
+                  saved = left*temp;
+            }
+            N[j] = saved;
+            if (dN != NULL)
+                  for (int t = 0; t < w; t += 1)
+                        dN[j*w+t] = dsaved[t];
+      }
+}
+
+
+template int find_span<float>(int, int, float, float*);
+template int find_span<double>(int, int, double, double*);
+template void basis_funs<float>(int, float, int, float*, float*);
+template void basis_funs<double>(int, double, int, double*, double*);
+template void basis_funs_batch<float>(int, int, const float*, int, float*, int*, float*);
+template void basis_funs_batch<double>(int, int, const double*, int, double*, int*, double*);
+template void basis_funs_knot_ders<float>(int, float, int, const float*, float, float*, float*);
+template void basis_funs_knot_ders<double>(int, double, int, const double*, double, double*, double*);
@@ -1,8 +1,25 @@
 #include <stdio.h>
 #include <stdlib.h>
 
+// Highest supported degree; sizes the stack buffers of basis_funs
+#define pmax 10
+
+// The routines below are instantiated for float and double; half precision
+// callers evaluate them in float.
+
 // Algorithm A2.1 (page 68)
-int find_span(int n, int p, float u, float* U);
+template <typename scalar_t>
+int find_span(int n, int p, scalar_t u, scalar_t* U);
 
 // Algorithm A2.2 (page 70)
-void basis_funs(int i, float u, int p, float* U, float* N);
\ No newline at end of file
+template <typename scalar_t>
+void basis_funs(int i, scalar_t u, int p, scalar_t* U, scalar_t* N);
+
+// Algorithm A2.1 and A2.2 applied to an array of parameters
+template <typename scalar_t>
+void basis_funs_batch(int n, int p, const scalar_t* u, int size, scalar_t* U, int* span, scalar_t* N);
+
+// Algorithm A2.2 guarded against zero denominators, with optional
+// derivatives of the basis functions w.r.t. the knots
+template <typename scalar_t>
+void basis_funs_knot_ders(int i, scalar_t u, int p, const scalar_t* U, scalar_t tol, scalar_t* N, scalar_t* dN);
@@ -3,10 +3,9 @@ import numpy as np
 from torch import nn
 from torch.autograd import Function
 from torch.autograd import Variable
-from NURBSDiff.curve_eval_cpp import forward as cpp_forward, backward as cpp_backward, pre_compute_basis as cpp_pre_compute_basis
-from NURBSDiff.curve_eval_cuda import pre_compute_basis, forward, backward
-from .utils import gen_knot_vector
-torch.manual_seed(120)
+from .utils import gen_knot_vector, basis_csr, csr_matmul, pre_compute_basis as torch_pre_compute_basis, find_span, ders_basis_matrix, rational_ders
+from .basis_cache import cached
+from .backends import load_extension
 
 
 
@@ -15,25 +14,54 @@ class CurveEval(torch.nn.Module):
     We can implement our own custom autograd Functions by subclassing
     torch.autograd.Function and implementing the forward and backward passes
     which operate on Tensors.
+
+    The backend is resolved on the first forward call from the device of the
+    input: the CUDA extension for CUDA inputs, the C++ extension otherwise,
+    and plain tensor operations when the matching extension is not built.
+    dvc='cuda', 'cpp' or 'torch' pins the backend instead. dtype sets the
+    precision of the parameters, knots and bases; control points are expected
+    in the same dtype.
     """
-    def __init__(self, m, knot_v=None,  dimension=3, p=2, out_dim=32, method='tc', dvc='cuda'):
+    def __init__(self, m, knot_v=None,  dimension=3, p=2, out_dim=32, method='tc', dvc=None, dtype=torch.float32):
         super(CurveEval, self).__init__()
         self.m = m
         self._dimension = dimension
         self.p = p
+        self.out_dim = out_dim
         if knot_v is not None:
-            self.U = knot_v
+            self.U = torch.as_tensor(knot_v, dtype=dtype)
         else:
-            self.U = torch.Tensor(np.array(gen_knot_vector(self.p, self.m)))
-        self.u = torch.linspace(0.0, 1.0, steps=out_dim,dtype=torch.float32)
+            self.U = torch.tensor(np.array(gen_knot_vector(self.p, self.m)), dtype=dtype)
+        self.u = torch.linspace(0.0, 1.0, steps=out_dim,dtype=dtype)
         self.method = method
         self.dvc = dvc
-        if self.dvc == 'cuda':
-            self.U = self.U.cuda()
-            self.u = self.u.cuda()
-            self.uspan, self.Nu = pre_compute_basis(self.u, self.U, m, p, out_dim, self._dimension)
+        self.backend = None
+        self.device = None
+
+
+    def _resolve(self, device):
+        backend = self.dvc or ('cuda' if device.type == 'cuda' else 'cpp')
+        ext = None
+        if backend == 'cuda':
+            ext = load_extension('curve_eval_cuda')
+        elif backend == 'cpp':
+            ext = load_extension('curve_eval_cpp')
+        if ext is None:
+            backend = 'torch'
+        m, p = self.m, self.p
+        self.U = self.U.to(device)
+        self.u = self.u.to(device)
+        if backend == 'torch':
+            precompute = lambda: torch_pre_compute_basis(self.u, self.U, m, p)
         else:
-            self.uspan, self.Nu = cpp_pre_compute_basis(self.u, self.U, m, p, out_dim, self._dimension)
+            precompute = lambda: tuple(ext.pre_compute_basis(self.u, self.U, m, p, self.out_dim, self._dimension))
+        self.uspan, self.Nu = cached(precompute, 'curve_basis', backend, self.u, self.U, m, p)
+        if self.method == 'sparse':
+            # (out_dim, m) basis matrix in CSR layout, p+1 non-zeros per row
+            self.Nu_mat = cached(lambda: basis_csr(self.uspan, self.Nu, p, m), 'csr', backend, self.u, self.U, m, p)
+        self.ext = ext
+        self.backend = backend
+        self.device = device
 
 
     def forward(self,input):
@@ -44,58 +72,68 @@ class CurveEval(torch.nn.Module):
         objects for use in the backward pass using the ctx.save_for_backward method.
         """
         # input will be of dimension (batch_size, m+1, n+1, dimension+1)
+        if self.device != input.device:
+            self._resolve(input.device)
 
-        if self.method == 'cpp':
-            out = CurveEvalFunc.apply(input, self.uspan, self.Nu, self.u, self.m, self.p, self._dimension, self.dvc)
+        if self.method == 'cpp' and self.backend != 'torch':
+            out = CurveEvalFunc.apply(input, self.uspan, self.Nu, self.u, self.m, self.p, self._dimension, self.ext)
             return out
-        elif self.method == 'tc':
+        elif self.method in ('tc', 'cpp'):
             # input[:,:,:self._dimension] = input[:,:,:self._dimension]*input[:,:,self._dimension].unsqueeze(-1)
-            curves = self.Nu[:,0].unsqueeze(-1)*input[:,(self.uspan-self.p).type(torch.LongTensor),:]
+            curves = self.Nu[:,0].unsqueeze(-1)*input[:,(self.uspan-self.p).long(),:]
             for j in range(1,self.p+1):
-                curves += self.Nu[:,j].unsqueeze(-1)*input[:,(self.uspan-self.p+j).type(torch.LongTensor),:]
+                curves += self.Nu[:,j].unsqueeze(-1)*input[:,(self.uspan-self.p+j).long(),:]
+            return curves[:,:,:self._dimension]/curves[:,:,self._dimension].unsqueeze(-1)
+        elif self.method == 'sparse':
+            batch_size = input.size(0)
+            # sparse (out_dim, m) @ dense (m, B*(d+1))
+            curves = csr_matmul(self.Nu_mat, input.transpose(0,1).reshape(self.m, -1))
+            curves = curves.view(-1, batch_size, self._dimension+1).transpose(0,1)
             return curves[:,:,:self._dimension]/curves[:,:,self._dimension].unsqueeze(-1)
 
 
 
+    def evaluate_ders(self, input, order=2):
+        """
+        Positions and analytic derivatives on the grid, in one pass.
+        input: (B, m, dimension+1). Returns CK: (B, order+1, out_dim,
+        dimension) where CK[:,k] is the k-th derivative and CK[:,0] the curve.
+        """
+        if self.device != input.device:
+            self._resolve(input.device)
+        # Exact spans, as for surfaces: the result does not depend on the backend
+        Nu = cached(lambda: ders_basis_matrix(self.u, self.U, find_span(self.u, self.U, self.m, self.p), self.p, self.m, order), 'ders', self.u, self.U, self.m, self.p, order)
+        Aders = torch.einsum('kum,bmd->bkud', Nu.to(input.dtype), input)
+        return rational_ders(Aders.unsqueeze(2), order).squeeze(2)
+
+
+
 class CurveEvalFunc(torch.autograd.Function):
 
     @staticmethod
-    def forward(ctx, ctrl_pts, uspan, Nu, u, m, p, _dimension, _device):
-        ctx.save_for_backward(ctrl_pts)
+    def forward(ctx, ctrl_pts, uspan, Nu, u, m, p, _dimension, ext):
         ctx.uspan = uspan
         ctx.Nu = Nu
         ctx.u = u
         ctx.m = m
         ctx.p = p
         ctx._dimension = _dimension
-        ctx._device = _device
-        if _device == 'cuda':
-            curves = forward(ctrl_pts, uspan, Nu, u, m, p, _dimension)
-        else:
-            curves = cpp_forward(ctrl_pts.cpu(), uspan.cpu(), Nu.cpu(), u.cpu(), m, p, _dimension)
-        ctx.curves = curves
-        return curves[:,:,:_dimension]/curves[:,:,_dimension].unsqueeze(-1)
+        ctx.ext = ext
+        # The kernels divide by the weight channel and return it separately
+        curves, weights = ext.forward(ctrl_pts, uspan, Nu, u, m, p, _dimension)
+        ctx.save_for_backward(ctrl_pts, curves, weights)
+        return curves
 
     @staticmethod
     def backward(ctx, grad_output):
-        ctrl_pts,  = ctx.saved_tensors
+        ctrl_pts, curves, weights = ctx.saved_tensors
         uspan = ctx.uspan
         Nu = ctx.Nu
         u = ctx.u
         m = ctx.m
         p = ctx.p
-        _device = ctx._device
         _dimension = ctx._dimension
-        curves = ctx.curves
-        grad_cw = torch.zeros((grad_output.size(0),grad_output.size(1),_dimension+1),dtype=torch.float32)
-        if _device == 'cuda':
-            grad_cw = grad_cw.cuda()
-        grad_cw[:,:,:_dimension] = grad_output
-        for d in range(_dimension):
-            grad_cw[:,:,_dimension] += grad_output[:,:,d]/curves[:,:,_dimension]
-        if _device == 'cuda':
-            grad_ctrl_pts  = backward(grad_cw, ctrl_pts, uspan, Nu, u, m, p, _dimension)
-        else:
-            grad_ctrl_pts  = cpp_backward(grad_cw, ctrl_pts, uspan, Nu, u, m, p, _dimension)
+        # The rational chain rule is applied inside the kernels
+        grad_ctrl_pts = ctx.ext.backward(grad_output.contiguous(), ctrl_pts, curves, weights, uspan, Nu, u, m, p, _dimension)
 
         return Variable(grad_ctrl_pts[0]), None, None, None, None, None, None, None
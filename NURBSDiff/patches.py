@@ -0,0 +1,143 @@
+import numpy as np
+import torch
+
+from .sink import EvalSink, open_sink
+from .utils import gen_knot_vector
+from .readers import read_smesh, read_json, read_ctrlpts, read_patches
+
+
+FORMAT = 'nurbsdiff-patches'
+
+
+def save_patches(path, patches, dtype=np.float64):
+    """
+    Writes NURBS patches into one binary container. patches: iterable of
+    dicts with 'degree' (p, q), 'knot_u', 'knot_v' and 'ctrl', the
+    homogeneous control net (m, n, d+1) with xyz premultiplied by the
+    weight, as SurfEval expects.
+
+    The container is a sink file (see sink.py) holding every array of every
+    patch back to back: 'degree' and 'size' (P, 2), knots and control
+    points concatenated in 'knot_u', 'knot_v' and 'ctrl' (sum m*n, d+1),
+    and an offset index (P+1,) into each.
+    """
+    patches = list(patches)
+    ctrl = [np.asarray(patch['ctrl'], dtype=dtype) for patch in patches]
+    knot_u = [np.asarray(patch['knot_u'], dtype=dtype).reshape(-1) for patch in patches]
+    knot_v = [np.asarray(patch['knot_v'], dtype=dtype).reshape(-1) for patch in patches]
+    if len(set(c.shape[-1] for c in ctrl)) > 1:
+        raise ValueError('all patches must have the same dimension')
+    P, d1 = len(patches), ctrl[0].shape[-1] if patches else 4
+
+    def offsets(arrays, size):
+        return np.concatenate(([0], np.cumsum([size(a) for a in arrays]))).astype(np.int64)
+
+    index = {
+        'degree': np.array([patch['degree'] for patch in patches], dtype=np.int32).reshape(P, 2),
+        'size': np.array([c.shape[:2] for c in ctrl], dtype=np.int32).reshape(P, 2),
+        'knot_u_offset': offsets(knot_u, len),
+        'knot_v_offset': offsets(knot_v, len),
+        'ctrl_offset': offsets(ctrl, lambda c: c.shape[0]*c.shape[1]),
+    }
+    fields = {name: (a.shape, a.dtype) for name, a in index.items()}
+    fields['knot_u'] = (index['knot_u_offset'][-1:], dtype)
+    fields['knot_v'] = (index['knot_v_offset'][-1:], dtype)
+    fields['ctrl'] = ((index['ctrl_offset'][-1], d1), dtype)
+    with EvalSink(path, fields, meta={'format': FORMAT, 'count': P, 'dimension': d1 - 1}) as sink:
+        for name, a in index.items():
+            sink[name][...] = a
+        if P:
+            sink['knot_u'][...] = np.concatenate(knot_u)
+            sink['knot_v'][...] = np.concatenate(knot_v)
+            sink['ctrl'][...] = np.concatenate([c.reshape(-1, d1) for c in ctrl])
+
+
+class PatchSet(object):
+    """
+    The patches of a container written by save_patches, memory-mapped: no
+    data is read until used, and every tensor returned is a view of the
+    mapping (copy-on-write, the file is never modified).
+
+    patches[i] returns a dict with 'degree' (p, q), 'knot_u', 'knot_v' and
+    'ctrl' (m, n, d+1) tensors; ctrl_pts() stacks patches of one size into
+    a (B, m, n, d+1) batch and surf_eval() builds the matching layer.
+    """
+    def __init__(self, path):
+        fields, meta = open_sink(path, mode='c', meta=True)
+        if meta.get('format') != FORMAT:
+            raise ValueError('%s is not a NURBSDiff patch container' % path)
+        self.path = path
+        self.dimension = meta['dimension']
+        self.fields = {name: torch.from_numpy(a) for name, a in fields.items()}
+        self.degree = self.fields['degree']
+        self.size = self.fields['size']
+
+    def __len__(self):
+        return self.degree.size(0)
+
+    def __getitem__(self, i):
+        f = self.fields
+        m, n = self.size[i].tolist()
+        c0, c1 = f['ctrl_offset'][i:i+2].tolist()
+        u0, u1 = f['knot_u_offset'][i:i+2].tolist()
+        v0, v1 = f['knot_v_offset'][i:i+2].tolist()
+        return {'degree': tuple(self.degree[i].tolist()),
+                'knot_u': f['knot_u'][u0:u1], 'knot_v': f['knot_v'][v0:v1],
+                'ctrl': f['ctrl'][c0:c1].view(m, n, -1)}
+
+    def groups(self):
+        # Indices of the patches sharing degrees and control net size, the
+        # unit a single SurfEval layer can evaluate as one batch
+        keys = torch.cat((self.degree, self.size), dim=1).tolist()
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(tuple(key), []).append(i)
+        return groups
+
+    def ctrl_pts(self, indices):
+        # (B, m, n, d+1) batch of patches with equal control net sizes
+        return torch.stack([self[i]['ctrl'] for i in indices])
+
+    def surf_eval(self, i, **kwargs):
+        """
+        SurfEval layer for patch i. The knot vectors are rescaled to [0, 1],
+        the parameter range SurfEval samples.
+        """
+        from .surf_eval import SurfEval
+        patch = self[i]
+        m, n = self.size[i].tolist()
+        p, q = patch['degree']
+        U, V = patch['knot_u'], patch['knot_v']
+        kwargs.setdefault('dtype', patch['ctrl'].dtype)
+        return SurfEval(m, n, dimension=self.dimension, p=p, q=q,
+            knot_u=(U - U[0])/(U[-1] - U[0]), knot_v=(V - V[0])/(V[-1] - V[0]), **kwargs)
+
+
+def load_patches(path):
+    return PatchSet(path)
+
+
+def read_npy(path, degree=(3, 3), knot_u=None, knot_v=None):
+    """
+    Patches from a .npy dump of homogeneous control nets, (m, n, d+1) or
+    (B, m, n, d+1). Without knot vectors, the defaults of SurfEval are used.
+    """
+    nets = np.load(path)
+    nets = nets.reshape((-1,) + nets.shape[-3:])
+    m, n = nets.shape[1:3]
+    knot_u = gen_knot_vector(degree[0], m) if knot_u is None else knot_u
+    knot_v = gen_knot_vector(degree[1], n) if knot_v is None else knot_v
+    return [{'degree': tuple(degree), 'knot_u': knot_u, 'knot_v': knot_v, 'ctrl': net} for net in nets]
+
+
+def convert(paths, out, dtype=np.float64, workers=8):
+    """
+    Packs smesh (.dat, .smesh) and geomdl JSON (.json) files into the
+    container out, in the order given; directories contribute all their
+    such files in natural order (smesh.2.dat before smesh.10.dat).
+    Returns the number of patches written. Other formats go through
+    read_ctrlpts / read_npy and save_patches.
+    """
+    patches = read_patches(paths, workers)
+    save_patches(out, patches, dtype)
+    return len(patches)
@@ -0,0 +1,78 @@
+import torch
+
+
+def point_inversion(layer, ctrl_pts, points, seeds=(16, 16), iterations=10, tol=1e-7):
+    """
+    Closest points on a batch of surfaces (point inversion, NURBS Book
+    section 6.1). Every query is seeded with the nearest sample of a coarse
+    seeds[0] x seeds[1] parameter grid and refined with vectorised Newton
+    iterations on f = (S-P).Su = 0, g = (S-P).Sv = 0, projected onto the
+    parameter domain. Where the Newton system is not positive definite the
+    Gauss-Newton step (first fundamental form only) is taken instead, and
+    steps are halved until the distance decreases, so no query ends up
+    farther than its seed.
+
+    layer: SurfEval providing knots and degrees, ctrl_pts: (B, m, n, d+1),
+    points: (B, N, d). Returns the parameters (B, N, 2), the foot points
+    (B, N, d) and the distances (B, N). The search itself runs without
+    gradients; foot points and distances are re-evaluated at the final
+    parameters and are differentiable w.r.t. ctrl_pts and points, which at
+    a minimum is the exact gradient of the distance.
+    """
+    U, V = layer.U, layer.V
+    lo = torch.stack((U[layer.p], V[layer.q])).to(device=points.device, dtype=points.dtype)
+    hi = torch.stack((U[layer.m], V[layer.n])).to(device=points.device, dtype=points.dtype)
+
+    with torch.no_grad():
+        ctrl = ctrl_pts.detach()
+        target = points.detach()
+        su = torch.linspace(0, 1, seeds[0], device=points.device, dtype=points.dtype)
+        sv = torch.linspace(0, 1, seeds[1], device=points.device, dtype=points.dtype)
+        grid = torch.stack(torch.meshgrid(su, sv, indexing='ij'), dim=-1).reshape(-1, 2)
+        grid = lo + grid*(hi - lo)
+        samples = layer.evaluate_at(ctrl, grid)
+        uv = grid[torch.cdist(target, samples).argmin(dim=-1)]
+
+        for _ in range(iterations):
+            SKL = layer.evaluate_ders_at(ctrl, uv, order=2)
+            S, Su, Sv = SKL[:,0,0], SKL[:,1,0], SKL[:,0,1]
+            Suu, Suv, Svv = SKL[:,2,0], SKL[:,1,1], SKL[:,0,2]
+            r = S - target
+            dist = (r*r).sum(-1)
+
+            f, g = (r*Su).sum(-1), (r*Sv).sum(-1)
+            E, F, G = (Su*Su).sum(-1), (Su*Sv).sum(-1), (Sv*Sv).sum(-1)
+            J00, J01, J11 = E + (r*Suu).sum(-1), F + (r*Suv).sum(-1), G + (r*Svv).sum(-1)
+            newton = (J00*J11 - J01*J01 > 0) & (J00 > 0)
+            J00, J01, J11 = torch.where(newton, J00, E), torch.where(newton, J01, F), torch.where(newton, J11, G)
+
+            # Projected step: a parameter held at a bound by a gradient pointing
+            # out of the domain is frozen and the other one solved for alone
+            grad = torch.stack((f, g), dim=-1)
+            active = ((uv <= lo) & (grad > 0)) | ((uv >= hi) & (grad < 0))
+            fu, fv = active[...,0], active[...,1]
+            J01 = torch.where(fu | fv, torch.zeros_like(J01), J01)
+            f = torch.where(fu, torch.zeros_like(f), f)
+            g = torch.where(fv, torch.zeros_like(g), g)
+            J00 = torch.where(fu, torch.ones_like(J00), J00)
+            J11 = torch.where(fv, torch.ones_like(J11), J11)
+            det = (J00*J11 - J01*J01).clamp(min=torch.finfo(dist.dtype).tiny)
+            step = torch.stack(((J11*f - J01*g)/det, (J00*g - J01*f)/det), dim=-1)
+
+            # Halve the step where it does not decrease the distance
+            new_uv = torch.max(torch.min(uv - step, hi), lo)
+            for _ in range(4):
+                worse = ((layer.evaluate_at(ctrl, new_uv) - target)**2).sum(-1) > dist
+                if not worse.any():
+                    break
+                step = torch.where(worse.unsqueeze(-1), 0.5*step, step)
+                new_uv = torch.max(torch.min(uv - step, hi), lo)
+            new_uv = torch.where(worse.unsqueeze(-1), uv, new_uv)
+
+            converged = (new_uv - uv).abs().max() < tol
+            uv = new_uv
+            if converged:
+                break
+
+    foot = layer.evaluate_at(ctrl_pts, uv)
+    return uv, foot, (foot - points).norm(dim=-1)
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+# Every reader parses a whole file at once: str.split and one numpy
+# conversion instead of a Python object per control point. Patches are
+# dicts with 'degree' (p, q), 'knot_u', 'knot_v' and 'ctrl', the
+# homogeneous control net (m, n, d+1) with xyz premultiplied by the weight.
+
+
+def _numbers(text, count=None):
+    # The first count numbers of text (all by default)
+    return np.array(text.split()[:count], dtype=np.float64)
+
+
+def _homogeneous(points, weights):
+    return np.concatenate((points*weights[..., None], weights[..., None]), axis=-1)
+
+
+def read_smesh(path):
+    """
+    One patch from a geomdl smesh file: dimension, degrees, control net
+    size, both knot vectors, then one "x y z w" line per control point
+    with u varying fastest. Anything after the control points is ignored.
+    """
+    with open(path) as f:
+        head = f.read().split('\n', 5)
+    if int(head[0]) != 3:
+        raise ValueError('%s: only 3-dimensional smesh files are supported' % path)
+    p, q = (int(x) for x in head[1].split())
+    m, n = (int(x) for x in head[2].split())
+    net = _numbers(head[5], m*n*4).reshape(n, m, 4).transpose(1, 0, 2)
+    return {'degree': (p, q), 'knot_u': _numbers(head[3]), 'knot_v': _numbers(head[4]),
+            'ctrl': _homogeneous(net[..., :3], net[..., 3])}
+
+
+def read_json(path):
+    """
+    Patches of a geomdl JSON export ({'shape': {'data': ...}}), with
+    control points as a flat or (size_u, size_v) nested list. Returns a
+    list, since one file may hold several surfaces.
+    """
+    with open(path) as f:
+        data = json.load(f)['shape']['data']
+    patches = []
+    for surf in (data if isinstance(data, list) else [data]):
+        m, n = surf['size_u'], surf['size_v']
+        points = np.asarray(surf['control_points']['points'], dtype=np.float64).reshape(m, n, -1)
+        weights = surf['control_points'].get('weights')
+        weights = np.ones((m, n)) if weights is None else np.asarray(weights, dtype=np.float64).reshape(m, n)
+        patches.append({'degree': (surf['degree_u'], surf['degree_v']),
+            'knot_u': np.asarray(surf['knotvector_u'], dtype=np.float64),
+            'knot_v': np.asarray(surf['knotvector_v'], dtype=np.float64),
+            'ctrl': _homogeneous(points, weights)})
+    return patches
+
+
+def read_weights(path, sep=',', count=None):
+    # Weights of a geomdl .weights file, separated by sep and any whitespace
+    with open(path) as f:
+        return _numbers(f.read().replace(sep, ' '), count)
+
+
+def read_ctrlpts(path, size, degree, knot_u, knot_v, weights=None):
+    """
+    One patch from a geomdl .ctrlpts text file ("x y z" per line, v varying
+    fastest) and an optional .weights file.
+    """
+    with open(path) as f:
+        lines = f.read().strip().split('\n', 1)
+    dim = len(lines[0].split())
+    points = _numbers(' '.join(lines), size[0]*size[1]*dim).reshape(size[0], size[1], dim)
+    w = np.ones(size) if weights is None else read_weights(weights, count=size[0]*size[1]).reshape(size)
+    return {'degree': tuple(degree), 'knot_u': np.asarray(knot_u, dtype=np.float64),
+            'knot_v': np.asarray(knot_v, dtype=np.float64), 'ctrl': _homogeneous(points, w)}
+
+
+def batch(patches, dtype=torch.float64):
+    """
+    Stacks patches of any sizes into padded tensors:
+        ctrl (B, m_max, n_max, d+1), zero beyond each net,
+        knot_u (B, ku_max), knot_v (B, kv_max), padded with the last knot,
+        degree (B, 2) and size (B, 2) as int64.
+    Patches sharing degrees and sizes can be fed to one SurfEval as
+    ctrl[:, :m, :n].
+    """
+    B = len(patches)
+    size = torch.tensor([patch['ctrl'].shape[:2] for patch in patches], dtype=torch.long).reshape(B, 2)
+    m, n = size.amax(0).tolist() if B else (0, 0)
+    d1 = patches[0]['ctrl'].shape[-1] if B else 4
+    ctrl = np.zeros((B, m, n, d1))
+    for i, patch in enumerate(patches):
+        ctrl[i, :patch['ctrl'].shape[0], :patch['ctrl'].shape[1]] = patch['ctrl']
+
+    def knots(name):
+        ku = max((len(patch[name]) for patch in patches), default=0)
+        out = np.empty((B, ku))
+        for i, patch in enumerate(patches):
+            k = np.asarray(patch[name], dtype=np.float64)
+            out[i, :len(k)] = k
+            out[i, len(k):] = k[-1]
+        return torch.from_numpy(out).to(dtype)
+
+    return {'ctrl': torch.from_numpy(ctrl).to(dtype), 'knot_u': knots('knot_u'), 'knot_v': knots('knot_v'),
+            'degree': torch.tensor([patch['degree'] for patch in patches], dtype=torch.long).reshape(B, 2),
+            'size': size}
+
+
+def _files(paths, extensions):
+    # Expands directories into their files with the given extensions, in
+    # natural order (smesh.2.dat before smesh.10.dat)
+    files = []
+    for path in ([paths] if isinstance(paths, str) else paths):
+        if os.path.isdir(path):
+            names = [name for name in os.listdir(path) if name.endswith(extensions)]
+            names.sort(key=lambda name: [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', name)])
+            files += [os.path.join(path, name) for name in names]
+        else:
+            files.append(path)
+    return files
+
+
+def read_patches(paths, workers=8):
+    """
+    Reads smesh (.dat, .smesh) and geomdl JSON (.json) files, or every such
+    file of the given directories, in parallel. Returns the list of
+    patches in file order.
+    """
+    files = _files(paths, ('.dat', '.smesh', '.json'))
+    read = lambda path: read_json(path) if path.endswith('.json') else [read_smesh(path)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [patch for patches in pool.map(read, files) for patch in patches]
+
+
+def load_batch(paths, dtype=torch.float64, workers=8):
+    # read_patches followed by batch: padded tensors ready for SurfEval
+    return batch(read_patches(paths, workers), dtype)
@@ -0,0 +1,152 @@
+import json
+import struct
+
+import numpy as np
+import torch
+
+from .utils import to_numpy
+
+
+MAGIC = b'NURBSDIF'
+VERSION = 1
+# Field data starts on this boundary, so memmaps are aligned for vector loads
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1)//ALIGN*ALIGN
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, size = struct.unpack('<8sII', f.read(16))
+        if magic != MAGIC:
+            raise ValueError('%s is not a NURBSDiff sink file' % path)
+        if version != VERSION:
+            raise ValueError('unsupported sink version %d in %s' % (version, path))
+        return json.loads(f.read(size).decode('utf-8')), 16 + size
+
+
+class EvalSink(object):
+    """
+    Raw binary file of named arrays (evaluated points, normals, parameters,
+    ...) written in place through numpy.memmap, so dumping a tessellation
+    costs one copy into the page cache instead of text formatting.
+
+    Layout: 8-byte magic, uint32 version, uint32 header size, a JSON header
+    {'fields': {name: {'dtype', 'shape', 'offset'}}}, then every field as
+    a C-contiguous array starting on a 64-byte boundary. The file is sized
+    up front; fields are filled by slice assignment (sink['points'][...] =
+    ...) or write(), e.g. straight from SurfEval.tiles(out=sink['points']).
+
+    fields: dict mapping each name to its shape, to a (shape, dtype) pair
+    or to a dict {'shape', 'dtype'}. A pair is told apart from a 2-D shape
+    by its second item, which must be a numpy dtype, a type or a string.
+    dtype: numpy dtype of the fields given by shape alone. meta: optional
+    JSON-serialisable dict stored in the header.
+    """
+    def __init__(self, path, fields, dtype=np.float32, meta=None):
+        header = {'fields': {}}
+        if meta is not None:
+            header['meta'] = meta
+        offset = 0
+        for name, spec in fields.items():
+            shape, field_dtype = _field(spec, dtype)
+            header['fields'][name] = {'dtype': field_dtype.str, 'shape': shape, 'offset': offset}
+            offset = _align(offset + int(np.prod(shape))*field_dtype.itemsize)
+        # Offsets in the header are relative to the start of the data block
+        text = json.dumps(header).encode('utf-8')
+        self.data_offset = _align(16 + len(text))
+        text = text.ljust(self.data_offset - 16)
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<8sII', MAGIC, VERSION, len(text)))
+            f.write(text)
+            f.truncate(self.data_offset + offset)
+        self.path = path
+        self.header = header
+        self.fields = _map(path, header, self.data_offset, 'r+')
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def write(self, name, value, index=Ellipsis):
+        # value: tensor or array, written into field name at index
+        if torch.is_tensor(value):
+            value = to_numpy(value)
+        self.fields[name][index] = value
+
+    def flush(self):
+        for field in self.fields.values():
+            field.flush()
+
+    def close(self):
+        self.flush()
+        self.fields = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _field(spec, dtype):
+    # (shape, dtype) of a field spec: a shape, a (shape, dtype) pair or a dict
+    if isinstance(spec, dict):
+        shape, dtype = spec['shape'], spec.get('dtype', dtype)
+    elif isinstance(spec, (tuple, list)) and len(spec) == 2 and isinstance(spec[1], (str, type, np.dtype)):
+        shape, dtype = spec
+    else:
+        shape = spec
+    shape = [int(s) for s in np.atleast_1d(shape)]
+    return shape, np.dtype(dtype)
+
+
+def _map(path, header, data_offset, mode):
+    fields = {}
+    for name, spec in header['fields'].items():
+        fields[name] = np.memmap(path, dtype=np.dtype(spec['dtype']), mode=mode,
+            offset=data_offset + spec['offset'], shape=tuple(spec['shape']))
+    return fields
+
+
+def open_sink(path, mode='r', meta=False):
+    """
+    Maps the fields of a sink file without reading them. Returns a dict of
+    numpy memmaps; torch.from_numpy() turns them into tensors without a
+    copy. With meta=True, the header metadata is returned as well.
+    """
+    header, data_offset = _read_header(path)
+    fields = _map(path, header, data_offset, mode)
+    if meta:
+        return fields, header.get('meta', {})
+    return fields
+
+
+def write_surfaces(path, layer, input, tile=(256, 256), normals=False, params=False, dtype=np.float32):
+    """
+    Streams the evaluation of a SurfEval layer into a new sink file, tile by
+    tile, so that peak memory does not grow with the grid. input: control
+    points (B, m, n, dimension+1). Writes 'points' (B, out_dim_u,
+    out_dim_v, dimension), and optionally unit 'normals' (same shape,
+    dimension 3 only) and the grid 'params' (out_dim_u, out_dim_v, 2).
+    """
+    B, out_u, out_v = input.size(0), layer.u.size(0), layer.v.size(0)
+    fields = {'points': (B, out_u, out_v, layer._dimension)}
+    if normals:
+        fields['normals'] = (B, out_u, out_v, 3)
+    if params:
+        fields['params'] = (out_u, out_v, 2)
+    with EvalSink(path, fields, dtype) as sink, torch.no_grad():
+        for su, sv, _ in layer.tiles(input, tile, out=sink['points']):
+            if not (normals or params):
+                continue
+            uv = torch.stack(torch.meshgrid(layer.u[su], layer.v[sv], indexing='ij'), dim=-1)
+            if params:
+                sink.write('params', uv, (su, sv))
+            if normals:
+                SKL = layer.evaluate_ders_at(input, uv.reshape(-1, 2).to(input.device), order=1)
+                N = torch.cross(SKL[:,1,0], SKL[:,0,1], dim=-1)
+                N = N/N.norm(dim=-1, keepdim=True).clamp(min=1e-12)
+                sink.write('normals', N.view(B, su.stop - su.start, sv.stop - sv.start, 3), (slice(None), su, sv))
+    return open_sink(path)
@@ -1,56 +1,80 @@
 import torch
 import numpy as np
-torch.manual_seed(0)
 from torch import nn
 from torch.autograd import Function
 from torch.autograd import Variable
-from NURBSDiff.surf_eval_cpp import pre_compute_basis as cpp_pre_compute_basis, forward as cpp_forward, backward as cpp_backward
-CUDA_AVAILABLE=True
 DELTA = 1e-8
-try:
-    from NURBSDiff.surf_eval_cuda import pre_compute_basis, forward, backward
-except:
-    CUDA_AVAILABLE=False
-from .utils import gen_knot_vector
+from .utils import gen_knot_vector, basis_matrix, basis_csr, csr_matmul, pre_compute_basis as torch_pre_compute_basis, find_span, ders_basis_funs, ders_basis_matrix, rational_ders, to_numpy
+from .basis_cache import cached
+from .backends import load_extension
 
 class SurfEval(torch.nn.Module):
     """
     We can implement our own custom autograd Functions by subclassing
     torch.autograd.Function and implementing the forward and backward passes
     which operate on Tensors.
+
+    dtype sets the precision of the parameters, knots and bases; control
+    points are expected in the same dtype. float16 and bfloat16 are
+    evaluated with float accumulation.
     """
-    def __init__(self, m, n, dimension=3, p=3, q=3, knot_u=None, knot_v=None, out_dim_u=32, out_dim_v=128, method='tc', dvc='cpp'):
+    def __init__(self, m, n, dimension=3, p=3, q=3, knot_u=None, knot_v=None, out_dim_u=32, out_dim_v=128, method='tc', dvc='cpp', dtype=torch.float32):
         super(SurfEval, self).__init__()
-        if not CUDA_AVAILABLE:
+        # The extension for the requested device is loaded here, on first use;
+        # without it the layer falls back to the C++ one and then to plain
+        # tensor operations. dvc='torch' uses the tensor operations only.
+        ext = load_extension('surf_eval_cuda') if dvc == 'cuda' else None
+        if ext is None and dvc != 'torch':
             dvc = 'cpp'
+            ext = load_extension('surf_eval_cpp')
+        if ext is None:
+            dvc = 'torch'
         self.m = m
         self.n = n
         self._dimension = dimension
         self.p, self.q = p, q
         if knot_u is not None:
-            self.U = torch.Tensor(knot_u)
+            self.U = torch.as_tensor(knot_u, dtype=dtype)
         else:
-            self.U = torch.Tensor(np.array(gen_knot_vector(self.p, self.m)))
+            self.U = torch.tensor(np.array(gen_knot_vector(self.p, self.m)), dtype=dtype)
         if knot_v is not None:
-            self.V = torch.Tensor(knot_v)
+            self.V = torch.as_tensor(knot_v, dtype=dtype)
         else:
-            self.V = torch.Tensor(np.array(gen_knot_vector(self.q, self.n)))
-        self.u = torch.linspace(0.0 + DELTA, 1.0 - DELTA, steps=out_dim_u, dtype=torch.float32)
-        self.v = torch.linspace(0.0 + DELTA, 1.0 - DELTA, steps=out_dim_v, dtype=torch.float32)
+            self.V = torch.tensor(np.array(gen_knot_vector(self.q, self.n)), dtype=dtype)
+        self.u = torch.linspace(0.0 + DELTA, 1.0 - DELTA, steps=out_dim_u, dtype=dtype)
+        self.v = torch.linspace(0.0 + DELTA, 1.0 - DELTA, steps=out_dim_v, dtype=dtype)
         self.method = method
         self.dvc = dvc
+        self.ext = ext
         if self.dvc == 'cuda':
             self.U = self.U.cuda()
             self.u = self.u.cuda()
             self.V = self.V.cuda()
             self.v = self.v.cuda()
-            self.uspan_uv, self.vspan_uv, self.Nu_uv, self.Nv_uv = pre_compute_basis(self.u, self.v, self.U, self.V, m, n, p , q, out_dim_u, self._dimension)
-            self.Nu_uv = self.Nu_uv.view(out_dim_u, p+1)
-            self.Nv_uv = self.Nv_uv.view(out_dim_v, q+1)
+        if ext is not None:
+            precompute = lambda: tuple(ext.pre_compute_basis(self.u, self.v, self.U, self.V, m, n, p, q, out_dim_u, self._dimension))
         else:
-            self.uspan_uv, self.vspan_uv, self.Nu_uv, self.Nv_uv = cpp_pre_compute_basis(self.u, self.v, self.U, self. V, m, n, p , q, out_dim_u, self._dimension)
-            self.Nu_uv = self.Nu_uv.view(out_dim_u, p+1)
-            self.Nv_uv = self.Nv_uv.view(out_dim_v, q+1)
+            def precompute():
+                uspan_uv, Nu_uv = torch_pre_compute_basis(self.u, self.U, m, p)
+                vspan_uv, Nv_uv = torch_pre_compute_basis(self.v, self.V, n, q)
+                return uspan_uv, vspan_uv, Nu_uv, Nv_uv
+        # Layers sharing knots, degrees and grids reuse one precomputed basis.
+        # The backend is part of the key: the extensions' find_span tolerates
+        # round-off at the knots, searchsorted does not, so spans may differ.
+        self.uspan_uv, self.vspan_uv, self.Nu_uv, self.Nv_uv = cached(
+            precompute, 'surf_basis', self.dvc, self.u, self.v, self.U, self.V, m, n, p, q)
+        self.Nu_uv = self.Nu_uv.view(out_dim_u, p+1)
+        self.Nv_uv = self.Nv_uv.view(out_dim_v, q+1)
+
+        if self.method == 'matmul':
+            # Dense (out_dim_u, m) and (out_dim_v, n) basis matrices, so that the
+            # surface is Nu @ P @ Nv^T and evaluation runs as two GEMMs
+            self.Nu_mat = cached(lambda: basis_matrix(self.uspan_uv, self.Nu_uv, p, m), 'dense', self.dvc, self.u, self.U, m, p)
+            self.Nv_mat = cached(lambda: basis_matrix(self.vspan_uv, self.Nv_uv, q, n), 'dense', self.dvc, self.v, self.V, n, q)
+        elif self.method == 'sparse':
+            # Same matrices in CSR layout: only the (p+1) non-zeros per row are stored
+            self.Nu_mat = cached(lambda: basis_csr(self.uspan_uv, self.Nu_uv, p, m), 'csr', self.dvc, self.u, self.U, m, p)
+            self.Nv_mat = cached(lambda: basis_csr(self.vspan_uv, self.Nv_uv, q, n), 'csr', self.dvc, self.v, self.V, n, q)
 
         # if self.method == 'tc':
         #     self.Nu_uv = self.Nu_uv.repeat(self.v.size(0), 1, 1)
@@ -65,10 +89,10 @@ class SurfEval(torch.nn.Module):
         """
         # input will be of dimension (batch_size, m+1, n+1, dimension)
 
-        if self.method == 'cpp':
-            out = SurfEvalFunc.apply(input, self.uspan_uv, self.vspan_uv, self.Nu_uv, self.Nv_uv, self.u, self.v, self.m, self.n, self.p, self.q, self._dimension, self.dvc)
+        if self.method == 'cpp' and self.ext is not None:
+            out = SurfEvalFunc.apply(input, self.uspan_uv, self.vspan_uv, self.Nu_uv, self.Nv_uv, self.u, self.v, self.m, self.n, self.p, self.q, self._dimension, self.ext)
             return out
-        elif self.method == 'tc':
+        elif self.method in ('tc', 'cpp'):
             surfaces = (self.Nu_uv[:,0].unsqueeze(0).unsqueeze(-1).unsqueeze(-1)*\
                 input[:,(self.uspan_uv - self.p).type(torch.LongTensor), :,:])[:,:, (self.vspan_uv-self.q).type(torch.LongTensor),:]*\
                 self.Nv_uv[:,0].unsqueeze(0).unsqueeze(0).unsqueeze(-1)
@@ -86,14 +110,191 @@ class SurfEval(torch.nn.Module):
 
             surfaces = surfaces[:,:,:,:self._dimension]/surfaces[:,:,:,self._dimension].unsqueeze(-1)
             return surfaces
+        elif self.method == 'matmul':
+            batch_size = input.size(0)
+            # (B, m, n, d+1) -> (B, m, d+1, out_v): contract v with a single GEMM
+            surfaces = torch.matmul(input.transpose(2,3), self.Nv_mat.t())
+            # (B, out_u, (d+1)*out_v): contract u with one GEMM per batch entry
+            surfaces = torch.matmul(self.Nu_mat, surfaces.reshape(batch_size, self.m, -1))
+            surfaces = surfaces.view(batch_size, -1, self._dimension+1, self.v.size(0)).transpose(2,3)
+            return surfaces[:,:,:,:self._dimension]/surfaces[:,:,:,self._dimension].unsqueeze(-1)
+        elif self.method == 'sparse':
+            batch_size = input.size(0)
+            # sparse (out_u, m) @ dense (m, B*n*(d+1))
+            surfaces = csr_matmul(self.Nu_mat, input.transpose(0,1).reshape(self.m, -1))
+            surfaces = surfaces.view(-1, batch_size, self.n, self._dimension+1)
+            # sparse (out_v, n) @ dense (n, out_u*B*(d+1))
+            surfaces = csr_matmul(self.Nv_mat, surfaces.permute(2,0,1,3).reshape(self.n, -1))
+            surfaces = surfaces.view(self.v.size(0), -1, batch_size, self._dimension+1).permute(2,1,0,3)
+            return surfaces[:,:,:,:self._dimension]/surfaces[:,:,:,self._dimension].unsqueeze(-1)
+
+    def update(self, out, input, changed):
+        """
+        Incremental re-evaluation after a few control points moved.
+        out: previous output of forward, (B, out_dim_u, out_dim_v,
+        dimension), updated in place and returned. When out or input
+        require grad, out may have been saved for backward, so a copy is
+        updated and returned instead. input: the edited
+        control points (B, m, n, dimension+1). changed: (K, 2) indices of
+        the moved control points, an (m, n) boolean mask, or a delta tensor
+        shaped like input whose non-zero entries mark them.
+
+        Only the grid rows and columns whose (p+1)x(q+1) support holds a
+        moved control point are recomputed, from the precomputed spans and
+        basis, at O(R(p+1)n + RC(q+1)) for R rows and C columns.
+        """
+        if changed.dim() == input.dim():
+            changed = changed.ne(0).any(-1).any(0)
+        if changed.dtype == torch.bool:
+            changed = changed.nonzero()
+        changed = changed.long().to(self.uspan_uv.device)
+        uspan, vspan = self.uspan_uv.long(), self.vspan_uv.long()
+        a, b = changed[:,0], changed[:,1]
+        rows = ((uspan.unsqueeze(1) >= a) & (uspan.unsqueeze(1) - self.p <= a)).any(1).nonzero().squeeze(1)
+        cols = ((vspan.unsqueeze(1) >= b) & (vspan.unsqueeze(1) - self.q <= b)).any(1).nonzero().squeeze(1)
+        if rows.numel() == 0 or cols.numel() == 0:
+            return out
+
+        if out.requires_grad or input.requires_grad:
+            out = out.clone()
+        out[:, rows.unsqueeze(1), cols] = self._block(self._rows(input, rows), cols)
+        return out
+
+    def tiles(self, input, tile=(256, 256), out=None):
+        """
+        Streams the evaluation of the grid in tiles of at most tile[0] x
+        tile[1] parameters, for tessellations too fine to hold at once.
+        input: (B, m, n, dimension+1). Yields (u slice, v slice, points)
+        with points of shape (B, rows, cols, dimension), row by row.
+
+        out: optional preallocated buffer (B, out_dim_u, out_dim_v,
+        dimension), a tensor or a numpy array / memmap, into which every
+        tile is written before it is yielded. Peak memory beyond out is one
+        tile plus a (B, tile[0], n, dimension+1) partial contraction.
+        """
+        out_u, out_v = self.u.size(0), self.v.size(0)
+        for u0 in range(0, out_u, tile[0]):
+            rows = torch.arange(u0, min(u0 + tile[0], out_u), device=self.uspan_uv.device)
+            partial = self._rows(input, rows)
+            for v0 in range(0, out_v, tile[1]):
+                cols = torch.arange(v0, min(v0 + tile[1], out_v), device=self.vspan_uv.device)
+                points = self._block(partial, cols)
+                su, sv = slice(u0, u0 + rows.numel()), slice(v0, v0 + cols.numel())
+                if isinstance(out, np.ndarray):
+                    out[:, su, sv] = to_numpy(points)
+                elif out is not None:
+                    out[:, su, sv] = points
+                yield su, sv, points
 
+    def _rows(self, input, rows):
+        # Contracts u for the given grid rows: (B, R, n, dimension+1)
+        ridx = (self.uspan_uv[rows].long() - self.p).unsqueeze(-1) + torch.arange(self.p+1, device=rows.device)
+        return torch.einsum('ri,brind->brnd', self.Nu_uv[rows].to(input.dtype), input[:,ridx])
+
+    def _block(self, partial, cols):
+        # Contracts v of a _rows result for the given grid columns and divides
+        # by the weight: (B, R, C, dimension)
+        cidx = (self.vspan_uv[cols].long() - self.q).unsqueeze(-1) + torch.arange(self.q+1, device=cols.device)
+        surfaces = torch.einsum('cj,brcjd->brcd', self.Nv_uv[cols].to(partial.dtype), partial[:,:,cidx])
+        return surfaces[...,:self._dimension]/surfaces[...,self._dimension].unsqueeze(-1)
+
+    def evaluate_ders(self, input, order=2):
+        """
+        Positions and analytic partial derivatives on the grid, in one pass.
+        input: (B, m, n, dimension+1). Returns SKL: (B, order+1, order+1,
+        out_dim_u, out_dim_v, dimension) where SKL[:,k,l] is the k-th u and
+        l-th v derivative (SKL[:,0,0] the surface, SKL[:,1,0] Su, SKL[:,1,1]
+        Suv, ...), for k+l <= order; the other entries are zero.
+        """
+        # Spans from the exact find_span of evaluate_ders_at, not the
+        # extension's tolerant one, so the grid and scattered paths agree
+        Nu = cached(lambda: ders_basis_matrix(self.u, self.U, find_span(self.u, self.U, self.m, self.p), self.p, self.m, order), 'ders', self.u, self.U, self.m, self.p, order)
+        Nv = cached(lambda: ders_basis_matrix(self.v, self.V, find_span(self.v, self.V, self.n, self.q), self.q, self.n, order), 'ders', self.v, self.V, self.n, self.q, order)
+        Aders = torch.einsum('kum,bmnd,lvn->bkluvd', Nu.to(input.dtype), input, Nv.to(input.dtype))
+        return rational_ders(Aders, order)
+
+    def evaluate_geometry(self, input, eps=1e-12):
+        """
+        Differential geometry of the surfaces on the grid, from one second
+        order derivative pass. Requires dimension=3. Returns a dict of
+        (B, out_dim_u, out_dim_v, ...) tensors:
+            points, normals (unit), Su, Sv,
+            first (E, F, G) and second (L, M, N) fundamental forms,
+            gaussian and mean curvature, k1 >= k2 principal curvatures.
+        eps guards the normalisation and the square root so that the result
+        stays differentiable at degenerate and umbilic points.
+        """
+        SKL = self.evaluate_ders(input, order=2)
+        Su, Sv = SKL[:,1,0], SKL[:,0,1]
+        Suu, Suv, Svv = SKL[:,2,0], SKL[:,1,1], SKL[:,0,2]
+
+        normals = torch.cross(Su, Sv, dim=-1)
+        normals = normals/torch.sqrt((normals*normals).sum(-1, keepdim=True) + eps)
+
+        E, F, G = (Su*Su).sum(-1), (Su*Sv).sum(-1), (Sv*Sv).sum(-1)
+        L, M, N = (Suu*normals).sum(-1), (Suv*normals).sum(-1), (Svv*normals).sum(-1)
+        det = E*G - F*F
+        gaussian = (L*N - M*M)/det
+        mean = (E*N - 2*F*M + G*L)/(2*det)
+        disc = torch.sqrt((mean*mean - gaussian).clamp(min=0) + eps)
+        return {'points': SKL[:,0,0], 'normals': normals, 'Su': Su, 'Sv': Sv,
+                'first_form': torch.stack((E, F, G), dim=-1),
+                'second_form': torch.stack((L, M, N), dim=-1),
+                'gaussian': gaussian, 'mean': mean,
+                'k1': mean + disc, 'k2': mean - disc}
+
+    def evaluate_at(self, ctrl_pts, uv):
+        """
+        Evaluates the surfaces at arbitrary parameters instead of the grid
+        fixed in __init__. ctrl_pts: (B, m, n, dimension+1), uv: (B, N, 2) or
+        (N, 2) shared by the batch. Returns (B, N, dimension).
+
+        Spans and basis functions are computed on the fly with tensor
+        operations, so the result is differentiable w.r.t. both the control
+        points and the parameters, at a cost of O(N(p+1)(q+1)).
+        """
+        uv, U, V = self._params(ctrl_pts, uv)
+        uspan, Nu = torch_pre_compute_basis(uv[...,0], U, self.m, self.p)
+        vspan, Nv = torch_pre_compute_basis(uv[...,1], V, self.n, self.q)
+        Pw = self._support(ctrl_pts, uspan, vspan)
+        surfaces = torch.einsum('bni,bnj,bnijd->bnd', Nu.to(ctrl_pts.dtype), Nv.to(ctrl_pts.dtype), Pw)
+        return surfaces[...,:self._dimension]/surfaces[...,self._dimension].unsqueeze(-1)
+
+    def evaluate_ders_at(self, ctrl_pts, uv, order=2):
+        """
+        Derivatives counterpart of evaluate_at, laid out as in evaluate_ders:
+        returns SKL: (B, order+1, order+1, N, dimension), differentiable
+        w.r.t. the control points and the parameters.
+        """
+        uv, U, V = self._params(ctrl_pts, uv)
+        uspan = find_span(uv[...,0], U, self.m, self.p)
+        vspan = find_span(uv[...,1], V, self.n, self.q)
+        Nu = ders_basis_funs(uv[...,0], U, uspan, self.p, order).to(ctrl_pts.dtype)
+        Nv = ders_basis_funs(uv[...,1], V, vspan, self.q, order).to(ctrl_pts.dtype)
+        Pw = self._support(ctrl_pts, uspan, vspan)
+        Aders = torch.einsum('kbni,lbnj,bnijd->bklnd', Nu, Nv, Pw)
+        return rational_ders(Aders, order)
+
+    def _params(self, ctrl_pts, uv):
+        # Broadcasts shared (N, 2) parameters over the batch and moves the
+        # knot vectors to their device and dtype
+        if uv.dim() == 2:
+            uv = uv.unsqueeze(0).expand(ctrl_pts.size(0), -1, -1)
+        return uv, self.U.to(device=uv.device, dtype=uv.dtype), self.V.to(device=uv.device, dtype=uv.dtype)
+
+    def _support(self, ctrl_pts, uspan, vspan):
+        # Gathers the (p+1)x(q+1) supporting control points of every parameter:
+        # (B, N, p+1, q+1, dimension+1)
+        rows = (uspan.long() - self.p).unsqueeze(-1) + torch.arange(self.p+1, device=uspan.device)
+        cols = (vspan.long() - self.q).unsqueeze(-1) + torch.arange(self.q+1, device=vspan.device)
+        batch = torch.arange(ctrl_pts.size(0), device=uspan.device).view(-1, 1, 1, 1)
+        return ctrl_pts[batch, rows.unsqueeze(-1), cols.unsqueeze(-2)]
 
 
 class SurfEvalFunc(torch.autograd.Function):
 
     @staticmethod
-    def forward(ctx, ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension, _device):
-        ctx.save_for_backward(ctrl_pts)
+    def forward(ctx, ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension, ext):
         ctx.uspan_uv = uspan_uv
         ctx.vspan_uv = vspan_uv
         ctx.Nu_uv = Nu_uv
@@ -105,19 +306,18 @@ class SurfEvalFunc(torch.autograd.Function):
         ctx.p = p
         ctx.q = q
         ctx._dimension = _dimension
-        ctx._device = _device
+        ctx.ext = ext
 
-        if _device == 'cuda':
-            surfaces = forward(ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
-        else:
-            surfaces = cpp_forward(ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
+        # The kernels divide by the weight channel themselves and return it
+        # separately; only the weights are kept beyond the output.
+        surfaces, weights = ext.forward(ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
 
-        ctx.surfaces=surfaces
-        return surfaces[:,:,:,:_dimension]/surfaces[:,:,:,_dimension].unsqueeze(-1)
+        ctx.save_for_backward(ctrl_pts, surfaces, weights)
+        return surfaces
 
     @staticmethod
     def backward(ctx, grad_output):
-        ctrl_pts,  = ctx.saved_tensors
+        ctrl_pts, surfaces, weights = ctx.saved_tensors
         uspan_uv = ctx.uspan_uv
         vspan_uv = ctx.vspan_uv
         Nu_uv = ctx.Nu_uv
@@ -129,23 +329,8 @@ class SurfEvalFunc(torch.autograd.Function):
         p = ctx.p
         q = ctx.q
         _dimension = ctx._dimension
-        _device = ctx._device
-        surfaces=ctx.surfaces
-        grad_sw = torch.zeros((grad_output.size(0),grad_output.size(1),grad_output.size(2),_dimension+1),dtype=torch.float32)
-        grad_sw[:,:,:,:_dimension] = grad_output
-        if _device == 'cuda':
-            grad_sw = grad_sw.cuda()
 
-        for d in range(_dimension):
-            grad_sw[:,:,:,_dimension] += grad_output[:,:,:,d]/surfaces[:,:,:,_dimension]
+        # The rational chain rule is applied inside the kernels
+        grad_ctrl_pts = ctx.ext.backward(grad_output, ctrl_pts, surfaces, weights, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
 
-
-        if _device == 'cuda':
-            grad_ctrl_pts = backward(grad_sw, ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
-        else:
-            grad_ctrl_pts = cpp_backward(grad_sw, ctrl_pts, uspan_uv, vspan_uv, Nu_uv, Nv_uv, u_uv, v_uv, m, n, p, q, _dimension)
-
-        
-        
         return Variable(grad_ctrl_pts[0]), None, None, None, None, None, None,None,None,None,None,None,None,None
-
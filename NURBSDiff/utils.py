@@ -1,4 +1,6 @@
 import numpy as np
+import torch
+from math import comb
 
 
 def gen_knot_vector(p,n, delta=1e-6):
@@ -19,4 +21,146 @@ def gen_knot_vector(p,n, delta=1e-6):
     knot_vector += [float(1) for j in range(0, p)]
 
     # Return auto-generated knot vector
-    return knot_vector
\ No newline at end of file
+    return knot_vector
+
+
+def basis_matrix(span, N, p, n):
+    # span: (out_dim,) knot spans, N: (out_dim, p+1) non-zero basis values,
+    # n: number of control points. Returns the dense (out_dim, n) basis matrix
+    # whose row i holds N[i] at columns span[i]-p ... span[i].
+    N = N.detach().view(span.size(0), p+1)
+    cols = span.long().unsqueeze(-1) - p + torch.arange(p+1, device=span.device)
+    return torch.zeros((span.size(0), n), dtype=N.dtype, device=N.device).scatter_(1, cols, N)
+
+
+def basis_csr(span, N, p, n):
+    # Same matrix as basis_matrix, stored in CSR layout. Every row has exactly
+    # p+1 non-zeros, so memory and products scale with (p+1)*out_dim instead
+    # of n*out_dim.
+    N = N.detach().view(span.size(0), p+1)
+    cols = span.long().unsqueeze(-1) - p + torch.arange(p+1, device=span.device)
+    crow = torch.arange(0, (p+1)*span.size(0) + 1, p+1, device=span.device)
+    return torch.sparse_csr_tensor(crow, cols.reshape(-1), N.reshape(-1), size=(span.size(0), n))
+
+
+def csr_matmul(A, x):
+    # Sparse CSR A @ dense x. The CPU kernels cover float and double only,
+    # so half and bfloat16 are multiplied in float32 and cast back.
+    if x.device.type == 'cpu' and x.dtype in (torch.float16, torch.bfloat16):
+        return torch.matmul(A.to(torch.float32), x.float()).to(x.dtype)
+    return torch.matmul(A, x)
+
+
+def find_span(u, U, m, p):
+    # Knot spans of a tensor of parameters of any shape, clamped to the valid
+    # range [p, m-1]. U: (m+p+1,) knot vector, m: number of control points.
+    return (torch.searchsorted(U.contiguous(), u.detach().contiguous(), right=True) - 1).clamp(p, m-1)
+
+
+def pre_compute_basis(u, U, m, p):
+    # Pure tensor counterpart of the compiled pre_compute_basis kernels, used
+    # when no extension is available for the device. u: (out_dim,) parameters,
+    # U: (m+p+1,) knot vector, m: number of control points. Returns the spans
+    # (out_dim,) as int32 and the non-zero basis functions (out_dim, p+1).
+    span = find_span(u, U, m, p)
+    left = [None] + [u - U[span+1-j] for j in range(1, p+1)]
+    right = [None] + [U[span+j] - u for j in range(1, p+1)]
+    N = [torch.ones_like(u)]
+    for j in range(1, p+1):
+        saved = torch.zeros_like(u)
+        N_j = []
+        for r in range(j):
+            temp = N[r]/(right[r+1] + left[j-r])
+            N_j.append(saved + right[r+1]*temp)
+            saved = left[j-r]*temp
+        N = N_j + [saved]
+    return span.int(), torch.stack(N, dim=-1)
+
+
+def ders_basis_funs(u, U, span, p, n):
+    # Algorithm A2.3 (page 72) over arrays of parameters. u: (N,) parameters,
+    # span: (N,) spans as returned by pre_compute_basis, n: highest derivative.
+    # Returns (n+1, N, p+1): the k-th derivatives of the p+1 non-zero basis
+    # functions; orders above p vanish.
+    span = span.long()
+    zero = torch.zeros_like(u)
+    left = [None] + [u - U[span+1-j] for j in range(1, p+1)]
+    right = [None] + [U[span+j] - u for j in range(1, p+1)]
+    # Upper triangle: basis functions, lower triangle: knot differences
+    ndu = [[None]*(p+1) for _ in range(p+1)]
+    ndu[0][0] = torch.ones_like(u)
+    for j in range(1, p+1):
+        saved = zero
+        for r in range(j):
+            ndu[j][r] = right[r+1] + left[j-r]
+            temp = ndu[r][j-1]/ndu[j][r]
+            ndu[r][j] = saved + right[r+1]*temp
+            saved = left[j-r]*temp
+        ndu[j][j] = saved
+
+    ders = [[ndu[j][p] for j in range(p+1)]] + [[zero]*(p+1) for _ in range(n)]
+    for r in range(p+1):
+        s1, s2 = 0, 1
+        a = [[None]*(p+1), [None]*(p+1)]
+        a[0][0] = torch.ones_like(u)
+        for k in range(1, min(n, p)+1):
+            d = zero
+            rk, pk = r-k, p-k
+            if r >= k:
+                a[s2][0] = a[s1][0]/ndu[pk+1][rk]
+                d = a[s2][0]*ndu[rk][pk]
+            j1 = 1 if rk >= -1 else -rk
+            j2 = k-1 if r-1 <= pk else p-r
+            for j in range(j1, j2+1):
+                a[s2][j] = (a[s1][j] - a[s1][j-1])/ndu[pk+1][rk+j]
+                d = d + a[s2][j]*ndu[rk+j][pk]
+            if r <= pk:
+                a[s2][k] = -a[s1][k-1]/ndu[pk+1][r]
+                d = d + a[s2][k]*ndu[r][pk]
+            ders[k][r] = d
+            s1, s2 = s2, s1
+    factor = p
+    for k in range(1, min(n, p)+1):
+        ders[k] = [N*factor for N in ders[k]]
+        factor *= p-k
+    return torch.stack([torch.stack(row, dim=-1) for row in ders])
+
+
+def ders_basis_matrix(u, U, span, p, n, order):
+    # Dense (order+1, out_dim, n) matrices of the basis function derivatives,
+    # the k-th holding the k-th derivatives laid out as in basis_matrix
+    ders = ders_basis_funs(u, U, span, p, order)
+    return torch.stack([basis_matrix(span, N, p, n) for N in ders])
+
+
+def rational_ders(Aders, order):
+    # Quotient rule of Algorithm A4.4 (page 137). Aders: (B, K, L, ..., d+1)
+    # mixed derivatives of the homogeneous points with the weight last (L=1
+    # for curves). Returns the derivatives (B, K, L, ..., d) of the projected
+    # points for k+l <= order; the remaining entries are zero.
+    A, w = Aders[...,:-1], Aders[...,-1:]
+    K, L = Aders.size(1), Aders.size(2)
+    SKL = [[None]*L for _ in range(K)]
+    for k in range(K):
+        for l in range(L):
+            if k + l > order:
+                SKL[k][l] = torch.zeros_like(A[:,0,0])
+                continue
+            v = A[:,k,l]
+            for j in range(1, l+1):
+                v = v - comb(l, j)*w[:,0,j]*SKL[k][l-j]
+            for i in range(1, k+1):
+                v = v - comb(k, i)*w[:,i,0]*SKL[k-i][l]
+                for j in range(1, l+1):
+                    v = v - comb(k, i)*comb(l, j)*w[:,i,j]*SKL[k-i][l-j]
+            SKL[k][l] = v/w[:,0,0]
+    return torch.stack([torch.stack(row, dim=1) for row in SKL], dim=1)
+
+
+def to_numpy(t):
+    # Detached CPU copy of a tensor as a numpy array. numpy has no bfloat16,
+    # so those tensors are widened to float32 first.
+    t = t.detach().cpu()
+    if t.dtype == torch.bfloat16:
+        t = t.float()
+    return t.numpy()
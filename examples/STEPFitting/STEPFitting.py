@@ -5,6 +5,8 @@ torch.manual_seed(120)
 from tqdm import tqdm
 # from pytorch3d.loss import chamfer_distance
 from NURBSDiff.surf_eval import SurfEval
+from NURBSDiff import chamfer
+from NURBSDiff.sink import EvalSink
 import matplotlib.pyplot as plt
 from torch.autograd import Variable
 from mpl_toolkits.mplot3d import Axes3D
@@ -71,6 +73,10 @@ def main():
     CtrlPts = [CtrlPtsNoW, Weights]
     target = torch.from_numpy(np.genfromtxt(dataFileName, delimiter='\t', dtype=np.float32))
     mumPoints = target.cpu().shape
+    # side=1 searches the evaluated points, which move every step, so a
+    # prebuilt index (TargetIndex) cannot serve it; the tiled search keeps
+    # this loss memory-bounded instead of materialising the M x N distances
+    target = target.view(1, mumPoints[0], 3).to(device)
 
     layer = SurfEval(CtrlPtsCountUV[0], CtrlPtsCountUV[1], knot_u=knotU, knot_v=knotV, dimension=3,
                      p=degree[0], q=degree[1], out_dim_u=uEvalPtSize, out_dim_v=vEvalPtSize, dvc=device)
@@ -85,7 +91,8 @@ def main():
 
     BaseAreaSurf = base_out.detach().cpu().numpy().squeeze()
     EvalPoints = np.reshape(BaseAreaSurf,(uEvalPtSize*vEvalPtSize,3))
-    np.savetxt("Eval.txt", EvalPoints, delimiter="\t")
+    with EvalSink("Eval.bin", {'points': EvalPoints.shape}) as sink:
+        sink.write('points', EvalPoints)
 
     base_length_u = ((BaseAreaSurf[:-1, :-1, :] - BaseAreaSurf[1:, :-1, :]) ** 2).sum(-1).squeeze()
     base_length_v = ((BaseAreaSurf[:-1, :-1, :] - BaseAreaSurf[:-1, 1:, :]) ** 2).sum(-1).squeeze()
@@ -135,10 +142,7 @@ def main():
             surf_max_curv = torch.sum(torch.tensor([surf_curv11,surf_curv22,surf_curv12,surf_curv21]))
 
             # lossVal = 0
-            if device == 'cuda':
-                lossVal = chamfer_distance_one_side(out.view(1, uEvalPtSize * vEvalPtSize, 3), target.view(1, mumPoints[0], 3).cuda())
-            else:
-                lossVal = chamfer_distance_one_side(out.view(1, uEvalPtSize * vEvalPtSize, 3), target.view(1, mumPoints[0], 3))
+            lossVal = chamfer.chamfer_distance_one_side(out.view(1, uEvalPtSize * vEvalPtSize, 3), target, side=1)
 
             # loss, _ = chamfer_distance(target.view(1, 360, 3), out.view(1, evalPtSize * evalPtSize, 3))
             # if (i < 100):
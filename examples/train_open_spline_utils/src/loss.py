@@ -161,6 +161,20 @@ def control_points_loss(output, control_points, grid_size):
     return loss
 
 
+def tensor_product_eval(nu, nv, output):
+    """
+    Evaluates nu @ P @ nv^T for the whole batch and all coordinates with
+    two batched matrix products.
+    :param nu: spline basis function in u direction.
+    :param nv: spline basis function in v direction.
+    :param output: control points of size batch_size x c_size_u x c_size_v x 3
+    """
+    batch_size, c_size_u, c_size_v, dim = output.shape
+    reconst_points = torch.matmul(output.transpose(2, 3), torch.transpose(nv, 1, 0))
+    reconst_points = torch.matmul(nu, reconst_points.reshape(batch_size, c_size_u, -1))
+    return reconst_points.view(batch_size, nu.shape[0], dim, nv.shape[0]).transpose(2, 3)
+
+
 def spline_reconstruction_loss_one_sided(nu, nv, output, points, config, side=1):
     """
     Spline reconsutruction loss defined using chamfer distance, but one
@@ -171,7 +185,6 @@ def spline_reconstruction_loss_one_sided(nu, nv, output, points, config, side=1)
     :param points: points sampled over the spline.
     :param config: object of configuration class for extra parameters. 
     """
-    reconst_points = []
     batch_size = output.shape[0]
     c_size_u = output.shape[1]
     c_size_v = output.shape[2]
@@ -180,31 +193,19 @@ def spline_reconstruction_loss_one_sided(nu, nv, output, points, config, side=1)
 
     output = output.view(config.batch_size, config.grid_size, config.grid_size, 3)
     points = points.permute(0, 2, 1)
-    for b in range(config.batch_size):
-        point = []
-        for i in range(3):
-            point.append(torch.matmul(torch.matmul(nu, output[b, :, :, i]), torch.transpose(nv, 1, 0)))
-        reconst_points.append(torch.stack(point, 2))
-
-    reconst_points = torch.stack(reconst_points, 0)
-    reconst_points = reconst_points.view(config.batch_size, grid_size_u * grid_size_v, 3)
+    reconst_points = tensor_product_eval(nu, nv, output)
+    reconst_points = reconst_points.reshape(config.batch_size, grid_size_u * grid_size_v, 3)
     dist = chamfer_distance_one_side(reconst_points, points, side)
     return dist, reconst_points
 
 
 def spline_reconstruction_loss(nu, nv, output, points, config, sqrt=False):
-    reconst_points = []
     batch_size = output.shape[0]
     grid_size = nu.shape[0]
     output = output.reshape(config.batch_size, nu.shape[1], nv.shape[1], 3)
     points = points.permute(0, 2, 1)
-    for b in range(config.batch_size):
-        point = []
-        for i in range(3):
-            point.append(torch.matmul(torch.matmul(nu, output[b, :, :, i]), torch.transpose(nv, 1, 0)))
-        reconst_points.append(torch.stack(point, 2))
-    reconst_points = torch.stack(reconst_points, 0)
-    reconst_points = reconst_points.view(config.batch_size, grid_size ** 2, 3)
+    reconst_points = tensor_product_eval(nu, nv, output)
+    reconst_points = reconst_points.reshape(config.batch_size, grid_size ** 2, 3)
     dist = chamfer_distance(reconst_points, points, sqrt=sqrt)
     return dist, reconst_points
 
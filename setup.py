@@ -1,17 +1,29 @@
 import os
+import sys
 from setuptools import setup, find_packages
 from torch.utils.cpp_extension import BuildExtension, CppExtension,CUDAExtension
 
+# The CPU kernels parallelise through at::parallel_for, which only spawns
+# threads when the extension itself is compiled with OpenMP enabled.
+if sys.platform == 'win32':
+    CPP_ARGS = ['/openmp']
+elif sys.platform == 'darwin':
+    CPP_ARGS = []
+else:
+    CPP_ARGS = ['-fopenmp']
+
 try:
     setup(
         name='NURBSDiff',
         ext_modules=[
             CppExtension(name='NURBSDiff.curve_eval_cpp',
                 sources=['NURBSDiff/csrc/curve_eval.cpp','NURBSDiff/csrc/utils.cpp'],
-                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/curve_eval.h']),
+                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/curve_eval.h'],
+                extra_compile_args=CPP_ARGS),
             CppExtension(name='NURBSDiff.surf_eval_cpp',
                 sources=['NURBSDiff/csrc/surf_eval.cpp','NURBSDiff/csrc/utils.cpp'],
-                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/surf_eval.h']),
+                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/surf_eval.h'],
+                extra_compile_args=CPP_ARGS),
             CUDAExtension(name='NURBSDiff.curve_eval_cuda',
                 sources=['NURBSDiff/csrc/curve_eval_cuda.cpp',
                 'NURBSDiff/csrc/curve_eval_cuda_kernel.cu']),
@@ -30,10 +42,12 @@ except:
         ext_modules=[
             CppExtension(name='NURBSDiff.curve_eval_cpp',
                 sources=['NURBSDiff/csrc/curve_eval.cpp','NURBSDiff/csrc/utils.cpp'],
-                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/curve_eval.h']),
+                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/curve_eval.h'],
+                extra_compile_args=CPP_ARGS),
             CppExtension(name='NURBSDiff.surf_eval_cpp',
                 sources=['NURBSDiff/csrc/surf_eval.cpp','NURBSDiff/csrc/utils.cpp'],
-                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/surf_eval.h']),
+                extra_include_paths=['NURBSDiff/csrc/utils.h','NURBSDiff/csrc/surf_eval.h'],
+                extra_compile_args=CPP_ARGS),
         ],
         cmdclass={
             'build_ext': BuildExtension
@@ -0,0 +1,59 @@
+import torch
+
+from NURBSDiff.chamfer import GridIndex, TargetIndex, _tiled_argmin
+
+
+def _distances(x, y, idx):
+    near = torch.gather(y, 1, idx.unsqueeze(-1).expand(-1, -1, y.size(-1)))
+    return ((x - near)**2).sum(-1)
+
+
+def _brute_force(x, y, chunk=256):
+    # Exact squared distance from every x to its nearest y, from explicit
+    # differences
+    return torch.cat([((x[:,i:i+chunk].unsqueeze(2) - y.unsqueeze(1))**2).sum(-1).amin(-1)
+                      for i in range(0, x.size(1), chunk)], dim=1)
+
+
+def _check(y, x):
+    ref = _brute_force(x, y)
+    assert torch.allclose(_distances(x, y, GridIndex(y).query(x)), ref, atol=1e-6)
+    assert torch.allclose(_distances(x, y, _tiled_argmin(x, y, 512)), ref, atol=1e-6)
+
+
+def test_collinear_target():
+    torch.manual_seed(0)
+    s = torch.rand(1, 2000, 1)
+    # Along an axis (two degenerate grid axes) and along a diagonal
+    _check(torch.cat((s, torch.zeros(1, 2000, 2)), dim=-1), torch.rand(1, 200, 3))
+    _check(s*torch.tensor([1.0, 2.0, 3.0]), 3*torch.rand(1, 200, 3))
+
+
+def test_coplanar_target():
+    torch.manual_seed(0)
+    y = torch.rand(2, 10000, 3)
+    y[..., 2] = 0
+    x = torch.rand(2, 5000, 3)
+    x[..., 2] = 0.3
+    _check(y, x)
+
+
+def test_far_queries():
+    torch.manual_seed(0)
+    _check(torch.rand(1, 5000, 3), torch.rand(1, 300, 3) + 10)
+
+
+def test_far_from_origin():
+    torch.manual_seed(0)
+    _check(torch.rand(1, 3000, 3) + 500, torch.rand(1, 3000, 3) + 500)
+
+
+def test_reverse_warm_start_resized_pred():
+    torch.manual_seed(0)
+    target = torch.rand(1, 500, 3)
+    index = TargetIndex(target)
+    for size in (400, 100, 400):
+        pred = torch.rand(1, size, 3)
+        d, idx = index.reverse_nearest(pred)
+        assert int(idx.max()) < size
+        assert torch.allclose(d, _brute_force(target, pred), atol=1e-6)
@@ -0,0 +1,71 @@
+import pytest
+import torch
+
+from NURBSDiff.backends import has_extension
+from NURBSDiff.curve_eval import CurveEval
+
+
+needs_cpp = pytest.mark.skipif(not has_extension('curve_eval_cpp'), reason='C++ extension not built')
+KNOT = [0, 0, 0, 0, 0.3, 0.35, 0.8, 1, 1, 1, 1]
+
+
+def _layer(method='tc', dtype=torch.float64, dvc=None, out_dim=17):
+    return CurveEval(7, knot_v=KNOT, p=3, out_dim=out_dim, method=method, dvc=dvc, dtype=dtype)
+
+
+def _ctrl_pts(B=2, m=7, dtype=torch.float64):
+    torch.manual_seed(0)
+    ctrl_pts = torch.rand(B, m, 4, dtype=dtype)
+    ctrl_pts[..., 3] += 0.5
+    ctrl_pts[..., :3] *= ctrl_pts[..., 3:]
+    return ctrl_pts
+
+
+@pytest.mark.parametrize('method, dvc', [pytest.param('cpp', 'cpp', marks=needs_cpp), ('tc', 'torch'), ('sparse', None)])
+def test_methods_match_tc(method, dvc):
+    ctrl_pts = _ctrl_pts()
+    ref = _layer('tc', dvc='torch')(ctrl_pts)
+    assert torch.allclose(_layer(method, dvc=dvc)(ctrl_pts), ref, atol=1e-12)
+
+
+@pytest.mark.parametrize('method', ['tc', pytest.param('cpp', marks=needs_cpp), 'sparse'])
+def test_gradcheck(method):
+    layer = _layer(method, out_dim=9)
+    ctrl_pts = _ctrl_pts(B=1).requires_grad_()
+    assert torch.autograd.gradcheck(layer, (ctrl_pts,))
+
+
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+@pytest.mark.parametrize('method', ['tc', pytest.param('cpp', marks=needs_cpp), 'sparse'])
+def test_reduced_precision(method, dtype):
+    ctrl_pts = _ctrl_pts()
+    out = _layer(method, dtype)(ctrl_pts.to(dtype))
+    assert out.dtype == dtype
+    assert torch.allclose(out.double(), _layer()(ctrl_pts), atol=0.05, rtol=0.05)
+
+
+@needs_cpp
+def test_cpp_rejects_bad_shapes():
+    layer = _layer('cpp')
+    with pytest.raises(RuntimeError):
+        layer(_ctrl_pts()[..., :3])
+    with pytest.raises(RuntimeError):
+        layer(_ctrl_pts(m=4))
+
+
+def _ders_at(ctrl_pts, u, order):
+    layer = _layer(out_dim=u.numel())
+    layer.u = u
+    return layer.evaluate_ders(ctrl_pts, order)
+
+
+def test_derivatives_match_finite_differences():
+    # Central differences of the curve and its first derivative, away from
+    # the knots
+    ctrl_pts = _ctrl_pts()
+    u = torch.linspace(0.05, 0.95, 9, dtype=torch.float64)
+    h = 1e-5
+    CK = _ders_at(ctrl_pts, u, 2)
+    lo, hi = _ders_at(ctrl_pts, u - h, 1), _ders_at(ctrl_pts, u + h, 1)
+    assert torch.allclose(CK[:, 1], (hi[:, 0] - lo[:, 0])/(2*h), atol=1e-6)
+    assert torch.allclose(CK[:, 2], (hi[:, 1] - lo[:, 1])/(2*h), atol=1e-5)
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import torch
+
+from NURBSDiff.patches import save_patches, load_patches, convert
+from NURBSDiff.readers import read_smesh, read_json, read_patches, batch
+from NURBSDiff.surf_eval import SurfEval
+
+
+def _knots(p, m):
+    # Clamped uniform knot vector on [0, 1]
+    return np.concatenate(([0.0]*p, np.linspace(0, 1, m - p + 1), [1.0]*p))
+
+
+def _patch(m, n, p=3, q=2, seed=0):
+    rng = np.random.RandomState(seed)
+    ctrl = rng.rand(m, n, 4)
+    ctrl[..., 3] += 0.5
+    ctrl[..., :3] *= ctrl[..., 3:]
+    return {'degree': (p, q), 'knot_u': _knots(p, m), 'knot_v': _knots(q, n), 'ctrl': ctrl}
+
+
+def _number(x):
+    return repr(float(x))
+
+
+def _write_smesh(path, patch):
+    m, n = patch['ctrl'].shape[:2]
+    ctrl = patch['ctrl']
+    # u varies fastest, xyz not premultiplied by the weight
+    lines = ['3', '%d %d' % patch['degree'], '%d %d' % (m, n),
+             ' '.join(map(_number, patch['knot_u'])), ' '.join(map(_number, patch['knot_v']))]
+    for j in range(n):
+        for i in range(m):
+            w = ctrl[i, j, 3]
+            lines.append(' '.join(map(_number, list(ctrl[i, j, :3]/w) + [w])))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _write_json(path, patches):
+    data = []
+    for patch in patches:
+        m, n = patch['ctrl'].shape[:2]
+        w = patch['ctrl'][..., 3]
+        data.append({'degree_u': patch['degree'][0], 'degree_v': patch['degree'][1], 'size_u': m, 'size_v': n,
+                     'knotvector_u': patch['knot_u'].tolist(), 'knotvector_v': patch['knot_v'].tolist(),
+                     'control_points': {'points': (patch['ctrl'][..., :3]/w[..., None]).reshape(-1, 3).tolist(),
+                                        'weights': w.reshape(-1).tolist()}})
+    with open(path, 'w') as f:
+        json.dump({'shape': {'data': data}}, f)
+
+
+def _assert_same(a, b):
+    assert tuple(a['degree']) == tuple(b['degree'])
+    for name in ('knot_u', 'knot_v', 'ctrl'):
+        assert np.allclose(np.asarray(a[name]), np.asarray(b[name]), atol=1e-12)
+
+
+def test_container_round_trip(tmp_path):
+    patches = [_patch(6, 5, seed=0), _patch(8, 4, 2, 3, seed=1), _patch(6, 5, seed=2)]
+    path = str(tmp_path/'patches.bin')
+    save_patches(path, patches)
+    loaded = load_patches(path)
+    assert len(loaded) == 3
+    for i, patch in enumerate(patches):
+        _assert_same(loaded[i], patch)
+    assert loaded.groups() == {(3, 2, 6, 5): [0, 2], (2, 3, 8, 4): [1]}
+    assert loaded.ctrl_pts([0, 2]).shape == (2, 6, 5, 4)
+
+    layer = loaded.surf_eval(1, out_dim_u=7, out_dim_v=6)
+    ref = SurfEval(8, 4, p=2, q=3, knot_u=_knots(2, 8), knot_v=_knots(3, 4), out_dim_u=7, out_dim_v=6,
+                   dtype=torch.float64)
+    ctrl_pts = loaded[1]['ctrl'].unsqueeze(0)
+    assert torch.allclose(layer(ctrl_pts), ref(ctrl_pts), atol=1e-12)
+
+
+def test_readers(tmp_path):
+    patches = [_patch(6, 5, seed=0), _patch(7, 4, seed=1), _patch(5, 5, 2, 2, seed=2)]
+    _write_smesh(str(tmp_path/'smesh.2.dat'), patches[0])
+    _write_smesh(str(tmp_path/'smesh.10.dat'), patches[2])
+    _write_json(str(tmp_path/'surf.json'), patches[:2])
+    _assert_same(read_smesh(str(tmp_path/'smesh.2.dat')), patches[0])
+    for read, patch in zip(read_json(str(tmp_path/'surf.json')), patches[:2]):
+        _assert_same(read, patch)
+
+    # Natural order: smesh.2.dat, smesh.10.dat, then surf.json
+    read = read_patches(str(tmp_path))
+    for got, patch in zip(read, [patches[0], patches[2]] + patches[:2]):
+        _assert_same(got, patch)
+
+    batched = batch(read)
+    assert batched['ctrl'].shape == (4, 7, 5, 4)
+    assert batched['size'].tolist() == [[6, 5], [5, 5], [6, 5], [7, 4]]
+    assert torch.all(batched['ctrl'][1, 5:] == 0)
+    assert torch.all(batched['knot_u'][1, -1] == 1)
+
+    path = str(tmp_path/'converted.bin')
+    assert convert([str(tmp_path)], path) == 4
+    loaded = load_patches(path)
+    for i, patch in enumerate(read):
+        _assert_same(loaded[i], patch)
@@ -0,0 +1,41 @@
+import torch
+
+from NURBSDiff.point_inversion import point_inversion
+from NURBSDiff.surf_eval import SurfEval
+
+
+def test_recovers_foot_points():
+    torch.manual_seed(0)
+    layer = SurfEval(6, 6, p=3, q=3, dtype=torch.float64)
+    u = torch.linspace(0, 1, 6, dtype=torch.float64)
+    grid = torch.stack(torch.meshgrid(u, u, indexing='ij'), dim=-1)
+    # A gently curved, rational sheet
+    z = 0.2*torch.sin(3*grid[..., :1]) + 0.1*grid[..., 1:]**2
+    w = 1 + 0.3*torch.rand(1, 6, 6, 1, dtype=torch.float64)
+    ctrl_pts = torch.cat((torch.cat((grid, z), dim=-1).unsqueeze(0)*w, w), dim=-1)
+
+    uv = 0.1 + 0.8*torch.rand(1, 50, 2, dtype=torch.float64)
+    geometry = layer.evaluate_ders_at(ctrl_pts, uv, order=1)
+    normals = torch.cross(geometry[:, 1, 0], geometry[:, 0, 1], dim=-1)
+    normals = normals/normals.norm(dim=-1, keepdim=True)
+    points = geometry[:, 0, 0] + 0.01*normals
+
+    found, foot, dist = point_inversion(layer, ctrl_pts, points)
+    assert torch.allclose(found, uv, atol=1e-6)
+    assert torch.allclose(foot, geometry[:, 0, 0], atol=1e-8)
+    assert torch.allclose(dist, torch.full_like(dist, 0.01), atol=1e-8)
+
+
+def test_never_worse_than_seed():
+    torch.manual_seed(0)
+    knots = [0, 0, 0, 1/3, 2/3, 1, 1, 1]
+    layer = SurfEval(5, 5, p=2, q=2, knot_u=knots, knot_v=knots, dtype=torch.float64)
+    ctrl_pts = torch.rand(2, 5, 5, 4, dtype=torch.float64) + 0.5
+    points = 3*torch.rand(2, 40, 3, dtype=torch.float64) - 1
+    _, foot, dist = point_inversion(layer, ctrl_pts, points)
+    # The default 16 x 16 seed grid
+    u = torch.linspace(0, 1, 16, dtype=torch.float64)
+    grid = torch.stack(torch.meshgrid(u, u, indexing='ij'), dim=-1).reshape(-1, 2)
+    seeds = ((points.unsqueeze(2) - layer.evaluate_at(ctrl_pts, grid).unsqueeze(1))**2).sum(-1).amin(-1).sqrt()
+    assert torch.all(dist <= seeds + 1e-12)
+    assert torch.allclose(dist, (foot - points).norm(dim=-1), atol=1e-12)
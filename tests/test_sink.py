@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+
+from NURBSDiff.sink import EvalSink, open_sink, write_surfaces
+from NURBSDiff.surf_eval import SurfEval
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path/'eval.bin')
+    fields = {'points': (2, 5, 3), 'pair': ((4, 2), 'int32'), 'typed': ((3,), np.float64),
+              'spec': {'shape': 7, 'dtype': np.dtype('uint8')}}
+    with EvalSink(path, fields, meta={'name': 'test'}) as sink:
+        sink['points'][...] = np.arange(30).reshape(2, 5, 3)
+        sink.write('pair', torch.arange(8, dtype=torch.int32).view(4, 2))
+        sink.write('typed', torch.tensor([1.0, 2.0, 3.0]).bfloat16())
+        sink['spec'][2:4] = 9
+    data, meta = open_sink(path, meta=True)
+    assert meta == {'name': 'test'}
+    assert data['points'].dtype == np.float32 and data['points'].shape == (2, 5, 3)
+    assert np.array_equal(data['points'], np.arange(30).reshape(2, 5, 3))
+    assert data['pair'].dtype == np.int32 and np.array_equal(data['pair'].ravel(), np.arange(8))
+    assert data['typed'].dtype == np.float64 and np.array_equal(data['typed'], [1, 2, 3])
+    assert np.array_equal(data['spec'], [0, 0, 9, 9, 0, 0, 0])
+    for field in data.values():
+        assert field.ctypes.data % 64 == 0
+
+
+def test_write_surfaces(tmp_path):
+    torch.manual_seed(0)
+    layer = SurfEval(6, 5, out_dim_u=11, out_dim_v=9)
+    ctrl_pts = torch.rand(2, 6, 5, 4) + 0.5
+    data = write_surfaces(str(tmp_path/'surf.bin'), layer, ctrl_pts, tile=(4, 4), normals=True, params=True)
+    assert np.allclose(data['points'], layer(ctrl_pts).numpy(), atol=1e-6)
+    assert np.allclose(np.linalg.norm(data['normals'], axis=-1), 1, atol=1e-5)
+    assert np.allclose(data['params'][:, 0, 0], layer.u.numpy())
+    assert np.allclose(data['params'][0, :, 1], layer.v.numpy())
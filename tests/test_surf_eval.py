@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import torch
+
+from NURBSDiff.backends import has_extension
+from NURBSDiff.surf_eval import SurfEval
+
+
+needs_cpp = pytest.mark.skipif(not has_extension('surf_eval_cpp'), reason='C++ extension not built')
+METHODS = [pytest.param('cpp', marks=needs_cpp), 'matmul', 'sparse']
+KNOT_U = [0, 0, 0, 0, 0.2, 0.45, 0.5, 1, 1, 1, 1]
+
+
+def _layer(method='tc', dtype=torch.float64, **kwargs):
+    kwargs.setdefault('out_dim_u', 13)
+    kwargs.setdefault('out_dim_v', 9)
+    return SurfEval(7, 5, p=3, q=2, knot_u=KNOT_U, method=method, dtype=dtype, **kwargs)
+
+
+def _ctrl_pts(B=2, m=7, n=5, dtype=torch.float64):
+    torch.manual_seed(0)
+    ctrl_pts = torch.rand(B, m, n, 4, dtype=dtype)
+    ctrl_pts[..., 3] += 0.5
+    ctrl_pts[..., :3] *= ctrl_pts[..., 3:]
+    return ctrl_pts
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_methods_match_tc(method):
+    ctrl_pts = _ctrl_pts()
+    ref = _layer('tc')(ctrl_pts)
+    assert torch.allclose(_layer(method)(ctrl_pts), ref, atol=1e-12)
+
+
+@pytest.mark.parametrize('method', ['tc'] + METHODS)
+def test_gradcheck(method):
+    layer = _layer(method, out_dim_u=6, out_dim_v=5)
+    ctrl_pts = _ctrl_pts(B=1).requires_grad_()
+    assert torch.autograd.gradcheck(layer, (ctrl_pts,))
+
+
+@pytest.mark.parametrize('dtype', [torch.float16, torch.bfloat16])
+@pytest.mark.parametrize('method', ['tc'] + METHODS)
+def test_reduced_precision(method, dtype):
+    ctrl_pts = _ctrl_pts()
+    ref = _layer('tc')(ctrl_pts)
+    out = _layer(method, dtype)(ctrl_pts.to(dtype))
+    assert out.dtype == dtype
+    assert torch.allclose(out.double(), ref, atol=0.05, rtol=0.05)
+
+
+@needs_cpp
+def test_torch_backend():
+    layer = _layer('cpp', dvc='torch')
+    assert layer.dvc == 'torch' and layer.ext is None
+    assert torch.allclose(layer(_ctrl_pts()), _layer('cpp')(_ctrl_pts()), atol=1e-12)
+
+
+@needs_cpp
+def test_cpp_rejects_bad_shapes():
+    layer = _layer('cpp')
+    with pytest.raises(RuntimeError):
+        layer(_ctrl_pts()[..., :3])
+    with pytest.raises(RuntimeError):
+        layer(_ctrl_pts(m=4))
+
+
+@pytest.mark.parametrize('method', ['tc'] + METHODS)
+def test_update(method):
+    layer = _layer(method)
+    ctrl_pts = _ctrl_pts().requires_grad_()
+    out = layer(ctrl_pts)
+    moved = ctrl_pts.detach().clone()
+    moved[:, 3, 2] += 0.1
+    moved.requires_grad_()
+    new = layer.update(out, moved, torch.tensor([[3, 2]]))
+    assert torch.allclose(new, layer(moved), atol=1e-12)
+    # The output saved for backward must not have been overwritten
+    (out.sum() + new.sum()).backward()
+    assert ctrl_pts.grad is not None and moved.grad is not None
+
+
+def test_tiles():
+    layer = _layer()
+    ctrl_pts = _ctrl_pts()
+    ref = layer(ctrl_pts)
+    out = np.zeros(ref.shape)
+    for su, sv, points in layer.tiles(ctrl_pts, (4, 3), out=out):
+        assert torch.allclose(points, ref[:, su, sv], atol=1e-12)
+    assert np.allclose(out, ref.numpy(), atol=1e-12)
+
+
+def test_evaluate_at_matches_grid():
+    layer = _layer()
+    ctrl_pts = _ctrl_pts()
+    uv = torch.stack(torch.meshgrid(layer.u, layer.v, indexing='ij'), dim=-1).reshape(-1, 2)
+    points = layer.evaluate_at(ctrl_pts, uv)
+    assert torch.allclose(points, layer(ctrl_pts).reshape(points.shape), atol=1e-12)
+    SKL = layer.evaluate_ders(ctrl_pts)
+    assert torch.allclose(layer.evaluate_ders_at(ctrl_pts, uv), SKL.reshape(SKL.shape[:3] + (-1, 3)), atol=1e-10)
+
+
+def test_derivatives_match_finite_differences():
+    layer = _layer()
+    ctrl_pts = _ctrl_pts()
+    uv = torch.tensor([[0.3, 0.6], [0.7, 0.2]], dtype=torch.float64)
+    SKL = layer.evaluate_ders_at(ctrl_pts, uv, order=1)
+    h = 1e-6
+    for k, step in ((1, torch.tensor([h, 0.0])), (0, torch.tensor([0.0, h]))):
+        fd = (layer.evaluate_at(ctrl_pts, uv + step) - layer.evaluate_at(ctrl_pts, uv - step))/(2*h)
+        assert torch.allclose(SKL[:, k, 1 - k], fd, atol=1e-6)
+
+
+def test_derivatives_near_knot():
+    # A knot within the extension's span tolerance of a grid parameter
+    knot_v = [0, 0, 0, 0.25000225, 0.5, 0.75, 1, 1, 1]
+    layer = SurfEval(5, 6, p=2, q=2, knot_v=knot_v, out_dim_u=5, out_dim_v=5, dtype=torch.float64)
+    ctrl_pts = _ctrl_pts(m=5, n=6)
+    uv = torch.stack(torch.meshgrid(layer.u, layer.v, indexing='ij'), dim=-1).reshape(-1, 2)
+    SKL = layer.evaluate_ders_at(ctrl_pts, uv)
+    assert torch.allclose(layer.evaluate_ders(ctrl_pts).reshape(SKL.shape), SKL, atol=1e-10)